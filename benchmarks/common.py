@@ -0,0 +1,18 @@
+'''
+    Helpers shared by the benchmark scripts (run them as `python benchmarks/<name>.py`,
+    which puts this directory on sys.path).
+'''
+import numpy as np
+
+def make_towers(num_towers, num_blocks, seed=0):
+    ''' A fixed, seeded set of `settings1` towers, cycling through the `num_blocks` sizes. '''
+    # imported here: loader_throughput sets MUJOCO_GL before block_towers pulls in dm_control
+    from block_towers.cubes import gen_start_positions_cubes
+    from block_towers.datasets import settings1
+    np.random.seed(seed)
+    towers = []
+    for idx in range(num_towers):
+        n = num_blocks[idx % len(num_blocks)]
+        params = {k: v for k,v in settings1[n].items() if k != 'num_blocks'}
+        towers.append(gen_start_positions_cubes(n, **params))
+    return towers
@@ -0,0 +1,56 @@
+'''
+    Import-time benchmark for block_towers.
+
+    Times each import statement in a fresh interpreter (the cost every joblib /
+    DataLoader worker pays at startup) and lists which heavy dependencies end up
+    loaded:
+
+        python benchmarks/import_time.py --repeats 5
+
+    "eager" imports every submodule, approximating the old `import block_towers`
+    (which star-imported cubes, render and simulation, and torch via cubes).
+'''
+import argparse
+import statistics
+import subprocess
+import sys
+
+heavy_modules = ['torch', 'matplotlib', 'IPython', 'PIL', 'dm_control', 'mujoco', 'fastprogress', 'joblib']
+
+statements = dict(
+    lazy='import block_towers',
+    generation='from block_towers import gen_start_positions_cubes, compute_will_fall',
+    simulation='from block_towers import run_simulation',
+    eager='import block_towers.cubes, block_towers.render, block_towers.simulation, torch',
+)
+
+probe = '''
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(','.join(m for m in {heavy_modules!r} if m in sys.modules))
+'''
+
+def time_import(statement, repeats):
+    times = []
+    for _ in range(repeats):
+        code = probe.format(statement=statement, heavy_modules=heavy_modules)
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        elapsed, loaded = out.split('\n')[-3:-1]
+        times.append(float(elapsed))
+    return times, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'case':<12} {'median (s)':>10} {'min (s)':>8}  heavy modules loaded")
+    for name, statement in statements.items():
+        times, loaded = time_import(statement, args.repeats)
+        print(f"{name:<12} {statistics.median(times):>10.3f} {min(times):>8.3f}  {loaded or '-'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+'''
+    DataLoader throughput benchmark for the render datasets of
+    `block_towers.loaders`: `TowerRenderDataset` (start positions) and
+    `TrajectoryFrameDataset` (frames of simulated towers, from a frame store).
+
+    Sweeps num_workers x prefetch_factor x batch size x pin_memory and reports,
+    for each setting, images/sec, per-batch latency percentiles, worker
+    start-up time (creating the iterator until the first batch arrives, which
+    includes forking the workers and building their physics engines) and the
+    peak RSS of the loader process plus its workers (summed, so pages shared
+    with forked workers count once per process):
+
+        python benchmarks/loader_throughput.py --datasets render trajectory \
+            --num-workers 0 2 4 8 --prefetch-factor 2 4 --batch-size 32 64 --pin-memory 0 1
+
+    Rendering uses OSMesa by default (software GL, as on CPU-only nodes); pass
+    --gl egl on GPU nodes. Latencies are measured after the first batch.
+'''
+import os
+import time
+import argparse
+import tempfile
+import threading
+import multiprocessing
+import numpy as np
+
+from common import make_towers
+
+def rss_bytes(pid):
+    ''' Resident set size of a process (Linux). '''
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (FileNotFoundError, ProcessLookupError):
+        return 0
+
+class PeakRSS(object):
+    ''' Samples the RSS of this process plus its (worker) children in a background thread. '''
+    def __init__(self, interval=.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def total(self):
+        return rss_bytes(os.getpid()) + sum(rss_bytes(child.pid) for child in multiprocessing.active_children())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.total())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.total())
+
+def make_datasets(args, tmp_dir):
+    from functools import partial
+    from block_towers.frame_store import write_frame_store
+    from block_towers.loaders import TowerRenderDataset, TrajectoryFrameDataset
+    from block_towers.simulation import generate_trajectory, generate_trajectories_parallel
+    from block_towers.world_models import generate_xml_model_from_start_positions
+
+    towers = make_towers(args.num_towers, args.num_blocks)
+    render_opts = dict(height=args.height, width=args.width, camera_id='closeup')
+    datasets = dict()
+    if 'render' in args.datasets:
+        datasets['render'] = TowerRenderDataset(towers, generate_xml_model_from_start_positions, render_opts=render_opts)
+    if 'trajectory' in args.datasets:
+        gen_fun = partial(generate_trajectory, xml_fun=generate_xml_model_from_start_positions, duration=args.duration)
+        simulations, _ = generate_trajectories_parallel(gen_fun, towers, num_workers=1, backend='threads')
+        labels = [int(any(p['unstable'] for p in positions)) for positions in towers]
+        store = write_frame_store(simulations, os.path.join(tmp_dir, 'frames'), labels=labels)
+        datasets['trajectory'] = TrajectoryFrameDataset(store, [sim['start_positions'] for sim in simulations],
+                                                        generate_xml_model_from_start_positions,
+                                                        frame_step=args.frame_step, render_opts=render_opts)
+    return datasets
+
+def run_loader(dataset, num_workers, prefetch_factor, batch_size, pin_memory, num_batches):
+    import torch
+    from torch.utils.data import DataLoader, RandomSampler
+    from block_towers.loaders import worker_init_fn
+
+    sampler = RandomSampler(dataset, replacement=True, num_samples=batch_size * (num_batches + 1))
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=sampler, num_workers=num_workers,
+                        pin_memory=pin_memory and torch.cuda.is_available(),
+                        prefetch_factor=prefetch_factor if num_workers > 0 else None,
+                        worker_init_fn=worker_init_fn if num_workers > 0 else None)
+    # engines built by an earlier in-process (num_workers=0) run would skip start-up
+    dataset.init_worker()
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        batches = iter(loader)
+        next(batches)
+        startup = time.perf_counter() - start
+
+        latencies = []
+        num_images = 0
+        prev = time.perf_counter()
+        for images, _ in batches:
+            now = time.perf_counter()
+            latencies.append(now - prev)
+            num_images += len(images)
+            prev = now
+        del batches
+
+    return dict(images_per_sec=num_images / sum(latencies), startup=startup, peak_rss=rss.peak,
+                latency=np.percentile(latencies, [50, 90, 99]) * 1000)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--datasets', nargs='+', choices=['render', 'trajectory'], default=['render', 'trajectory'])
+    parser.add_argument('--num-towers', type=int, default=64)
+    parser.add_argument('--num-blocks', type=int, nargs='+', default=[3, 4, 5, 6])
+    parser.add_argument('--duration', type=float, default=1.0, help='simulated seconds per tower (trajectory dataset)')
+    parser.add_argument('--frame-step', type=int, default=4, help='render every n-th stored frame (trajectory dataset)')
+    parser.add_argument('--height', type=int, default=224)
+    parser.add_argument('--width', type=int, default=224)
+    parser.add_argument('--num-workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--prefetch-factor', type=int, nargs='+', default=[2])
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[32])
+    parser.add_argument('--pin-memory', type=int, nargs='+', choices=[0, 1], default=[0],
+                        help='pin_memory (only takes effect with CUDA)')
+    parser.add_argument('--num-batches', type=int, default=20, help='timed batches per setting (after the first)')
+    parser.add_argument('--gl', default='osmesa', help='MuJoCo GL backend (MUJOCO_GL): osmesa, egl or glfw')
+    args = parser.parse_args()
+
+    # must be set before dm_control is first imported
+    os.environ['MUJOCO_GL'] = args.gl
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        datasets = make_datasets(args, tmp_dir)
+
+        header = (f"{'dataset':<11} {'workers':>7} {'prefetch':>8} {'batch':>5} {'pin':>3} {'images/s':>9} "
+                  f"{'p50 (ms)':>9} {'p90 (ms)':>9} {'p99 (ms)':>9} {'startup (s)':>11} {'peak RSS (MB)':>13}")
+        rows = [header]
+        for name, dataset in datasets.items():
+            for num_workers in args.num_workers:
+                # prefetch_factor only applies with workers
+                for prefetch_factor in (args.prefetch_factor if num_workers > 0 else [None]):
+                    for batch_size in args.batch_size:
+                        for pin_memory in args.pin_memory:
+                            result = run_loader(dataset, num_workers, prefetch_factor, batch_size, bool(pin_memory),
+                                                args.num_batches)
+                            p50, p90, p99 = result['latency']
+                            prefetch = '-' if prefetch_factor is None else prefetch_factor
+                            rows.append(f"{name:<11} {num_workers:>7} {prefetch:>8} {batch_size:>5} {pin_memory:>3} "
+                                        f"{result['images_per_sec']:>9.1f} {p50:>9.1f} {p90:>9.1f} {p99:>9.1f} "
+                                        f"{result['startup']:>11.2f} {result['peak_rss'] / 2**20:>13.0f}")
+
+    # after the progress bars
+    print('\n' + '\n'.join(rows))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+'''
+    Physics profile benchmark: throughput and accuracy of a world-model
+    physics profile (default: "fast") against MuJoCo's defaults, on a fixed,
+    seeded set of towers:
+
+        python benchmarks/physics_profiles.py --num-towers 200 --profile fast
+
+    Accuracy is reported as agreement of the `fell` outcome, the error in
+    fall_time, and the distance between final block positions (see
+    `block_towers.simulation.compare_physics_profiles`).
+
+    "fast" only lowers the solver iterations, line-search iterations and
+    tolerance (see `physics_profiles` in the world models); every contact is
+    kept, and Euler is already MuJoCo's default integrator, so the integrator
+    is not part of the speed-up.
+'''
+import argparse
+import json
+
+from common import make_towers
+from block_towers.simulation import compare_physics_profiles
+from block_towers.world_models import generate_xml_model_from_start_positions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-towers', type=int, default=100)
+    parser.add_argument('--num-blocks', type=int, nargs='+', default=[3, 4, 5, 6])
+    parser.add_argument('--profile', default='fast')
+    parser.add_argument('--reference', default='default')
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--timestep', type=float, default=.001)
+    parser.add_argument('--backend', choices=['threads', 'processes'], default='threads')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    towers = make_towers(args.num_towers, args.num_blocks, seed=args.seed)
+    report = compare_physics_profiles(towers, generate_xml_model_from_start_positions, profile=args.profile,
+                                      reference=args.reference, duration=args.duration, timestep=args.timestep,
+                                      backend=args.backend)
+    print()
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
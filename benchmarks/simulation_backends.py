@@ -0,0 +1,57 @@
+'''
+    Simulation backend benchmark: joblib processes vs. the thread pool of
+    `block_towers.threaded`.
+
+    Simulates the same towers with both backends at each worker count and
+    reports wall time, towers/sec, and whether the results agree (the thread
+    backend reproduces `generate_trajectory` exactly):
+
+        python benchmarks/simulation_backends.py --num-towers 200 --num-workers 1 2 4 8
+
+    Process times include pool start-up (imports and model compilation in
+    every worker), which is what a notebook or a short job pays.
+'''
+import argparse
+import time
+from functools import partial
+
+from common import make_towers
+from block_towers.simulation import generate_trajectory, generate_trajectories_parallel
+from block_towers.world_models import generate_xml_model_from_start_positions
+
+def run_backend(gen_fun, towers, num_workers, backend):
+    start = time.perf_counter()
+    simulations, _ = generate_trajectories_parallel(gen_fun, towers, num_workers=num_workers, backend=backend)
+    return time.perf_counter() - start, simulations
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-towers', type=int, default=100)
+    parser.add_argument('--num-blocks', type=int, nargs='+', default=[3, 4, 5, 6])
+    parser.add_argument('--num-workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--timestep', type=float, default=.001)
+    args = parser.parse_args()
+
+    towers = make_towers(args.num_towers, args.num_blocks)
+    gen_fun = partial(generate_trajectory, xml_fun=generate_xml_model_from_start_positions,
+                      duration=args.duration, timestep=args.timestep)
+
+    rows = [f"{'backend':<10} {'workers':>7} {'time (s)':>9} {'towers/s':>9}  results"]
+    for num_workers in args.num_workers:
+        reference = None
+        for backend in ['processes', 'threads']:
+            elapsed, simulations = run_backend(gen_fun, towers, num_workers, backend)
+            if reference is None:
+                reference, check = simulations, 'reference'
+            else:
+                same = sum(a['trajectory'] == b['trajectory'] and a['summary'] == b['summary']
+                           for a, b in zip(reference, simulations))
+                check = f'{same}/{len(towers)} identical'
+            rows.append(f"{backend:<10} {num_workers:>7} {elapsed:>9.2f} {len(towers)/elapsed:>9.1f}  {check}")
+
+    # after the progress bars
+    print('\n' + '\n'.join(rows))
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,47 @@
 import os
+import importlib
 
 if not os.environ.get('MUJOCO_GL', None):
     os.environ['MUJOCO_GL']='egl'
 
-from .cubes import *
-from .render import *
-from .simulation import *
-from .utils import *
\ No newline at end of file
+# Submodules are imported on first use (PEP 562), so `import block_towers` stays cheap:
+# tower generation and stability labels (cubes, towerstats) only need numpy, while
+# simulation/render pull in dm_control/MuJoCo (and render needs PIL).
+# `from block_towers import X` and `block_towers.X` work as before.
+_lazy_names = {
+    'cubes': ['init_block', 'coords', 'block_keys', 'towers_to_array', 'array_to_towers',
+              'bounded_random_normal', 'gen_start_positions_cubes', 'top_block_intervals',
+              'gen_start_positions_cubes_margin'],
+    'towerstats': ['compute_will_fall', 'compute_will_fall_array'],
+    'augment': ['sample_transforms', 'apply_transforms', 'augment_array', 'augment_towers', 'augmented_world_models'],
+    'cache': ['SimulationCache'],
+    'threaded': ['generate_trajectories_threaded'],
+    'render': ['default_render_opts', 'render_first_frame', 'render_image', 'get_physics_engine',
+               'render_from_simulation', 'MultiViewRenderer', 'render_views', 'pyramid_sizes',
+               'area_downsample', 'render_pyramid', 'make_renderer',
+               'show_tower', 'show_tower_grid', 'display_video'],
+    'simulation': ['get_num_boxes', 'get_geom_names', 'get_geom_types', 'get_geom_data', 'get_box_positions',
+                   'get_box_data', 'get_box_ids', 'iter_simulation', 'run_simulation', 'iter_trajectory',
+                   'generate_trajectory', 'get_physics_state', 'set_physics_state', 'nudge_block',
+                   'run_branches', 'generate_branched_trajectories', 'generate_batch_initial_positions',
+                   'generate_trajectories_parallel', 'compare_physics_profiles'],
+}
+_name_to_module = {name: module for module, names in _lazy_names.items() for name in names}
+
+_submodules = ['augment', 'cache', 'cli', 'cubes', 'datasets', 'frame_store', 'helpers', 'loaders', 'raster', 'render', 'simulation',
+               'threaded', 'tower_index', 'towerstats', 'trajectory', 'utils', 'world_models']
+
+__all__ = sorted(_name_to_module)
+
+def __getattr__(name):
+    if name in _name_to_module:
+        module = importlib.import_module(f'.{_name_to_module[name]}', __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if name in _submodules:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_submodules))
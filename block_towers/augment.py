@@ -0,0 +1,116 @@
+'''
+    Batched symmetry and jitter augmentation of towers.
+
+    Mirroring a tower in x or y, swapping the roles of the x and y axes, or
+    shifting the whole tower across the floor gives new stimuli without another
+    round of `gen_start_positions_cubes` rejection sampling, and re-ordering the
+    block colors gives new images of the same physics. `augment_array` applies
+    random combinations of these to a (num_towers, max_blocks, len(keys)) array
+    (see `towers_to_array`) with a few vectorized operations, and relabels every
+    variant in bulk with `compute_will_fall_array`:
+
+        augmented = augment_towers(towers, num_variants=8, mirror_y=True, translate_std=.01)
+        world_models = augmented_world_models(augmented['towers'], augmented['colors'])
+
+    Variants of tower i are rows i*num_variants ... (i+1)*num_variants-1; with
+    `include_original`, the first of them is the tower itself. Random draws use
+    the global numpy generator (seed with np.random.seed, as for tower generation).
+'''
+import numpy as np
+
+from .cubes import block_keys, towers_to_array, array_to_towers
+from .towerstats import compute_will_fall_array
+from .world_models import default_colors, generate_xml_model_from_start_positions
+
+def sample_transforms(num_towers, num_variants, mirror_x=True, mirror_y=False, swap_axes=False, translate_std=0.0,
+                      permute_colors=True, num_colors=len(default_colors), include_original=True):
+    ''' Random transforms for num_towers*num_variants variants, as a dict of per-variant arrays:
+
+        source: index of the tower a variant is made from
+        mirror_x, mirror_y, swap_axes: bools (each drawn with p=.5 where enabled), applied swap first
+        translate: (dx, dy) shift of the whole tower, normal with std `translate_std`
+        color_order: permutation of the `num_colors` block colors
+    '''
+    num = num_towers * num_variants
+    flip = lambda enabled: np.random.rand(num) < .5 if enabled else np.zeros(num, dtype=bool)
+    transforms = dict(
+        source=np.repeat(np.arange(num_towers), num_variants),
+        mirror_x=flip(mirror_x),
+        mirror_y=flip(mirror_y),
+        swap_axes=flip(swap_axes),
+        translate=np.random.normal(0, translate_std, (num, 2)) if translate_std else np.zeros((num, 2)),
+        color_order=(np.random.rand(num, num_colors).argsort(axis=1) if permute_colors
+                     else np.tile(np.arange(num_colors), (num, 1))),
+    )
+    if include_original:
+        for key in ('mirror_x', 'mirror_y', 'swap_axes'):
+            transforms[key][::num_variants] = False
+        transforms['translate'][::num_variants] = 0
+        transforms['color_order'][::num_variants] = np.arange(num_colors)
+    return transforms
+
+def apply_transforms(arr, transforms, keys=block_keys):
+    ''' Apply `transforms` (see `sample_transforms`) to towers `arr` (num_towers, max_blocks, len(keys)).
+
+        Returns (variants, any_fall, will_fall): the (num_variants_total, max_blocks, len(keys))
+        variants, with an 'unstable' column (if in keys) recomputed, and their labels from
+        `compute_will_fall_array`.
+    '''
+    arr = np.asarray(arr, dtype=float)
+    rotations = [keys.index(k) for k in ('rx', 'ry', 'rz') if k in keys]
+    if np.any(np.nan_to_num(arr[..., rotations]) != 0):
+        raise ValueError("augmentation assumes axis-aligned blocks (rx = ry = rz = 0)")
+
+    out = arr[transforms['source']]
+    columns = [keys.index(k) for k in ('x', 'y', 'lx', 'ly')]
+    xy = out[..., columns]
+    swap = transforms['swap_axes'][:, None, None]
+    xy = np.where(swap, xy[..., [1, 0, 3, 2]], xy)
+    xy[..., 0] = np.where(transforms['mirror_x'][:, None], -xy[..., 0], xy[..., 0]) + transforms['translate'][:, :1]
+    xy[..., 1] = np.where(transforms['mirror_y'][:, None], -xy[..., 1], xy[..., 1]) + transforms['translate'][:, 1:]
+    out[..., columns] = xy
+
+    any_fall, will_fall = compute_will_fall_array(out, keys=keys)
+    if 'unstable' in keys:
+        out[..., keys.index('unstable')] = np.where(np.isnan(out[..., 0]), np.nan, will_fall)
+    return out, any_fall, will_fall
+
+def augment_array(arr, num_variants, keys=block_keys, **options):
+    ''' Expand towers `arr` (num_towers, max_blocks, len(keys)) into num_variants random variants each.
+
+        options: see `sample_transforms`
+        Returns (variants, labels, will_fall, transforms), with labels (1 if any block falls)
+        and will_fall (per block) recomputed for every variant.
+    '''
+    arr = np.asarray(arr, dtype=float)
+    transforms = sample_transforms(len(arr), num_variants, **options)
+    variants, any_fall, will_fall = apply_transforms(arr, transforms, keys=keys)
+    return variants, any_fall.astype(int), will_fall, transforms
+
+def augment_towers(towers, num_variants, colors=default_colors, **options):
+    ''' `augment_array` for towers as lists of block dicts (e.g. from `gen_start_positions_cubes`).
+
+        Returns dict(towers, labels, colors, transforms): the variant towers (block dicts with
+        'unstable' recomputed), their labels, and the (re-ordered) block colors of each variant,
+        to pass to the world model (see `augmented_world_models`).
+    '''
+    if max(len(positions) for positions in towers) > len(colors):
+        raise ValueError(f"towers have more blocks than the {len(colors)} colors")
+    arr = towers_to_array(towers)
+    variants, labels, will_fall, transforms = augment_array(arr, num_variants, num_colors=len(colors), **options)
+
+    augmented = array_to_towers(variants)
+    for positions, unstable in zip(augmented, will_fall):
+        for idx, block in enumerate(positions):
+            block['unstable'] = int(unstable[idx])
+
+    return dict(
+        towers=augmented,
+        labels=labels.tolist(),
+        colors=[[colors[idx] for idx in order] for order in transforms['color_order']],
+        transforms=transforms,
+    )
+
+def augmented_world_models(towers, colors, xml_fun=generate_xml_model_from_start_positions, **kwargs):
+    ''' World models of augmented towers, each with its own color order (kwargs are passed to xml_fun). '''
+    return [xml_fun(positions, colors=tower_colors, **kwargs) for positions, tower_colors in zip(towers, colors)]
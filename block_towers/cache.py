@@ -0,0 +1,149 @@
+'''
+    Content-addressed on-disk cache of simulation results.
+
+    A simulation is fully determined by the scaled start positions, the world
+    model (which captures the xml_fun variant: static/dynamic model, colors,
+    cameras, physics profile), the simulation params and the MuJoCo version.
+    `generate_trajectory(..., cache=cache)` hashes these into a key and only
+    simulates on a miss, so regenerating a dataset with new splits or labels
+    re-uses every rollout it has seen before:
+
+        cache = SimulationCache('/scratch/sim-cache', max_bytes=20 * 2**30)
+        gen_fun = partial(generate_trajectory, xml_fun=generate_xml_model_from_start_positions,
+                          compact=True, cache=cache)
+        ...
+        cache.stats()  # dict(hits=..., misses=..., entries=..., bytes=...)
+
+    Entries are pickled simulation dicts with the trajectory always in the
+    compact format (float32, see `block_towers.trajectory.encode_trajectory`),
+    one file per key, written atomically; `get` returns it in the format the
+    caller asked for, so the key does not depend on `compact`/`compact_dtype`.
+    Non-compact hits are decoded from float32 (~1e-7 relative error).
+    An sqlite index keeps their sizes and last access times for LRU eviction
+    under `max_bytes`, and the hit/miss counters, so the cache can be shared
+    by joblib workers and across runs.
+'''
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import mujoco
+
+from .trajectory import encode_trajectory, expand_trajectory, is_compact_trajectory
+
+cache_version = 2
+
+# the generate_trajectory arguments that change the simulated result (not its output format)
+cached_params = ('duration', 'framerate', 'timestep', 'scale_factor', 'fall_tol', 'keyframe_tol')
+
+# dtype of the stored compact trajectories
+cache_dtype = 'float32'
+
+class SimulationCache(object):
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        self._db = None
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER, last_access REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            self.db.executemany('INSERT OR IGNORE INTO counters VALUES (?, 0)', [('hits',), ('misses',)])
+
+    def __repr__(self):
+        # stable across processes, so gen_fun descriptions (e.g. in checkpoint manifests) stay comparable
+        return f'SimulationCache({self.path!r}, max_bytes={self.max_bytes!r})'
+
+    @property
+    def db(self):
+        # connections can't be pickled or shared by forked workers: open one per process
+        if self._db is None or self._pid != os.getpid():
+            self._db = sqlite3.connect(os.path.join(self.path, 'index.sqlite'), timeout=60, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._db
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_db'] = None
+        return state
+
+    def key(self, scaled_positions, world_model, params):
+        ''' sha256 of the canonical (sorted-key JSON, exact float repr) description of a simulation;
+            `params` holds (at least) the `cached_params` arguments of generate_trajectory. '''
+        description = dict(version=cache_version, mujoco=mujoco.__version__, start_positions=scaled_positions,
+                           world_model=world_model, params={k: params[k] for k in cached_params})
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=float).encode()).hexdigest()
+
+    def object_path(self, key):
+        return os.path.join(self.path, 'objects', key[:2], f'{key}.pkl')
+
+    def _count(self, name):
+        self.db.execute('UPDATE counters SET value = value + 1 WHERE name = ?', (name,))
+
+    def get(self, key, compact=False, compact_dtype='float32'):
+        ''' The cached simulation for `key`, or None (counted as a hit or a miss), with the
+            trajectory in the format of generate_trajectory(compact=..., compact_dtype=...). '''
+        try:
+            with open(self.object_path(key), 'rb') as f:
+                simulation = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self._count('misses')
+            return None
+        with self.db:
+            self.db.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._count('hits')
+
+        if not compact:
+            simulation['trajectory'] = expand_trajectory(simulation['trajectory'])
+        elif compact_dtype != cache_dtype:
+            simulation['trajectory'] = encode_trajectory(simulation['trajectory'], dtype=compact_dtype)
+        return simulation
+
+    def put(self, key, simulation):
+        ''' Store `simulation`, encoding its trajectory in the compact format; pass it at full
+            precision (non-compact, or compact float32) so later hits of any format stay accurate. '''
+        trajectory = simulation['trajectory']
+        if not (is_compact_trajectory(trajectory) and trajectory['dtype'] == cache_dtype):
+            simulation = dict(simulation, trajectory=encode_trajectory(trajectory, dtype=cache_dtype))
+        path = self.object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(simulation, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)', (key, os.path.getsize(path), time.time()))
+        if self.max_bytes is not None:
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes):
+        ''' Delete least recently used entries until the cache holds at most `max_bytes`. '''
+        with self.db:
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total <= max_bytes:
+                return
+            for key, size in self.db.execute('SELECT key, size FROM entries ORDER BY last_access').fetchall():
+                if total <= max_bytes:
+                    break
+                self.db.execute('DELETE FROM entries WHERE key = ?', (key,))
+                try:
+                    os.remove(self.object_path(key))
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        counters = dict(self.db.execute('SELECT name, value FROM counters').fetchall())
+        entries, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return dict(hits=counters['hits'], misses=counters['misses'], entries=entries, bytes=size)
+
+    def reset_stats(self):
+        self.db.execute('UPDATE counters SET value = 0')
+
+    def clear(self):
+        ''' Delete every entry (the counters are kept). '''
+        self.evict(0)
@@ -0,0 +1,207 @@
+'''
+    Command-line entry point for sharded, deterministic dataset generation.
+
+    Each preset config (e.g. `settings1`, one entry per num_blocks) is cut into
+    units of `--shard-size` towers. Unit u of num_blocks n is generated from its
+    own seed, derived from (--seed, n, u), and units are dealt round-robin to the
+    shards, so the dataset does not depend on how many shards it was split into. Shards
+    can run on separate nodes against local disk with no coordination, and a
+    preempted shard resumes by skipping the units it already finished:
+
+        # on node i of N
+        python -m block_towers.cli generate --preset settings1 --num-samples 20000 \
+            --shard-index $i --num-shards $N --output-dir /scratch/towers [--simulate]
+
+        # after copying every node's output into one directory
+        python -m block_towers.cli merge --output-dir /scratch/towers --save-dir /data/towers
+
+    `merge` assembles the usual DatasetDict (`stack{n}_stable` / `stack{n}_unstable`,
+    each with train/test splits), as produced by `generate_blocktower_dataset`
+    (or `generate_trajectory_datasets` when the shards were simulated).
+'''
+import os
+import sys
+import json
+import glob
+import argparse
+import numpy as np
+from functools import partial
+
+from datasets import DatasetDict, concatenate_datasets, load_from_disk
+
+from .cubes import gen_start_positions_cubes
+from .datasets import (settings1, settings2, layouts, towers_to_dataset, simulate_split, manifest_path,
+                       save_manifest, save_dataset_atomic)
+from .simulation import generate_batch_initial_positions, generate_trajectory
+from .cache import SimulationCache
+from .world_models import generate_xml_model_from_start_positions
+
+presets = dict(settings1=settings1, settings2=settings2)
+
+def get_units(settings, num_samples, shard_size):
+    ''' All work units of a run, in a fixed order: (num_blocks, unit_idx, unit_num_samples). '''
+    units = []
+    for num_blocks in sorted(settings):
+        for unit_idx, start in enumerate(range(0, num_samples, shard_size)):
+            units.append((num_blocks, unit_idx, min(shard_size, num_samples - start)))
+    return units
+
+def unit_seed(seed, num_blocks, unit_idx):
+    return int(np.random.SeedSequence([seed, num_blocks, unit_idx]).generate_state(1)[0])
+
+def unit_path(output_dir, num_blocks, unit_idx):
+    return os.path.join(output_dir, 'units', f'stack{num_blocks}', f'unit-{unit_idx:05d}')
+
+def run_config(args):
+    ''' Everything that determines the generated data; shards of one run must agree on it. '''
+    config = dict(preset=args.preset, num_samples=args.num_samples, shard_size=args.shard_size,
+                  pct_fall=args.pct_fall, seed=args.seed, num_blocks=sorted(get_settings(args)),
+                  layout=args.layout, simulate=args.simulate)
+    if args.simulate:
+        config['sim_params'] = dict(duration=args.duration, framerate=args.framerate, timestep=args.timestep,
+                                    scale_factor=args.scale_factor, compact=args.compact)
+    return config
+
+def get_settings(args):
+    settings = presets[args.preset]
+    if args.num_blocks:
+        settings = {n: settings[n] for n in args.num_blocks}
+    return settings
+
+def get_cache(args):
+    if args.cache_dir is None:
+        return None
+    max_bytes = None if args.cache_max_gb is None else int(args.cache_max_gb * 2**30)
+    return SimulationCache(args.cache_dir, max_bytes=max_bytes)
+
+def generate_unit(settings, num_blocks, unit_idx, unit_num_samples, args):
+    np.random.seed(unit_seed(args.seed, num_blocks, unit_idx))
+    stable, unstable = generate_batch_initial_positions(gen_start_positions_cubes, **settings[num_blocks],
+                                                        num_samples=unit_num_samples, pct_fall=args.pct_fall)
+    dataset = towers_to_dataset(stable + unstable, [0] * len(stable) + [1] * len(unstable), num_blocks,
+                                layout=args.layout)
+
+    if args.simulate:
+        gen_fun = partial(generate_trajectory, xml_fun=generate_xml_model_from_start_positions,
+                          duration=args.duration, framerate=args.framerate, timestep=args.timestep,
+                          scale_factor=args.scale_factor, compact=args.compact, cache=get_cache(args))
+        dataset = simulate_split(dataset, gen_fun)
+
+    return dataset
+
+def generate(args):
+    if not 0 <= args.shard_index < args.num_shards:
+        raise ValueError(f"--shard-index must be in [0, {args.num_shards}), got {args.shard_index}")
+
+    settings = get_settings(args)
+    config = run_config(args)
+    manifest_name = f'manifest-{args.shard_index:05d}-of-{args.num_shards:05d}'
+    manifest_file = manifest_path(args.output_dir, manifest_name)
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest['config'] != config:
+            raise ValueError(f"{manifest_file} was written with a different config; use a new --output-dir")
+    else:
+        manifest = dict(config=config, shard_index=args.shard_index, num_shards=args.num_shards, done=[])
+        os.makedirs(args.output_dir, exist_ok=True)
+        save_manifest(args.output_dir, manifest, name=manifest_name)
+
+    units = [unit for idx, unit in enumerate(get_units(settings, args.num_samples, args.shard_size))
+             if idx % args.num_shards == args.shard_index]
+    for num_blocks, unit_idx, unit_num_samples in units:
+        name = f'stack{num_blocks}/unit-{unit_idx:05d}'
+        if name in manifest['done']:
+            print(f"==> {name}: done, skipping")
+            continue
+        print(f"==> {name}: generating {unit_num_samples} towers")
+        dataset = generate_unit(settings, num_blocks, unit_idx, unit_num_samples, args)
+
+        save_dataset_atomic(dataset, unit_path(args.output_dir, num_blocks, unit_idx))
+        manifest['done'].append(name)
+        save_manifest(args.output_dir, manifest, name=manifest_name)
+
+def merge(args):
+    manifests = []
+    for manifest_file in sorted(glob.glob(os.path.join(args.output_dir, 'manifest-*-of-*.json'))):
+        with open(manifest_file) as f:
+            manifests.append(json.load(f))
+    if not manifests:
+        raise FileNotFoundError(f"no shard manifests found in {args.output_dir}")
+
+    config = manifests[0]['config']
+    if any(manifest['config'] != config for manifest in manifests):
+        raise ValueError("shard manifests were written with different configs")
+    done = {name for manifest in manifests for name in manifest['done']}
+
+    settings = {n: presets[config['preset']][n] for n in config['num_blocks']}
+    units = get_units(settings, config['num_samples'], config['shard_size'])
+    missing = [f'stack{n}/unit-{u:05d}' for n, u, _ in units if f'stack{n}/unit-{u:05d}' not in done]
+    if missing:
+        raise ValueError(f"{len(missing)} units are not finished yet, e.g. {missing[:3]}")
+
+    data = dict()
+    for num_blocks in config['num_blocks']:
+        dataset = concatenate_datasets([load_from_disk(unit_path(args.output_dir, n, u))
+                                        for n, u, _ in units if n == num_blocks])
+        for label, name in enumerate(['stable', 'unstable']):
+            subset = dataset.filter(lambda labels: [l == label for l in labels], input_columns='label', batched=True)
+            data[f'stack{num_blocks}_{name}'] = subset.train_test_split(test_size=args.test_size, seed=config['seed'])
+    dataset = DatasetDict(data)
+
+    # nested DatasetDicts can't be saved as one, so each config gets its own directory
+    # (like the per-config subsets pushed to the hub)
+    save_dir = args.save_dir or os.path.join(args.output_dir, 'merged')
+    for config_name, subset in dataset.items():
+        subset.save_to_disk(os.path.join(save_dir, config_name))
+    print(dataset)
+    print(f"==> saved to {save_dir}")
+
+    return dataset
+
+def load_merged(save_dir):
+    ''' Load the output of `merge` back into a DatasetDict of per-config DatasetDicts. '''
+    return DatasetDict({config_name: load_from_disk(os.path.join(save_dir, config_name))
+                        for config_name in sorted(os.listdir(save_dir))})
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='block-towers', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help='generate one shard of a dataset')
+    gen.add_argument('--preset', choices=sorted(presets), default='settings1')
+    gen.add_argument('--num-blocks', type=int, nargs='+', default=None, help='subset of the preset (default: all)')
+    gen.add_argument('--num-samples', type=int, required=True, help='towers per num_blocks (stable + unstable)')
+    gen.add_argument('--pct-fall', type=float, default=.50)
+    gen.add_argument('--shard-size', type=int, default=1000, help='towers per work unit')
+    gen.add_argument('--shard-index', type=int, default=0)
+    gen.add_argument('--num-shards', type=int, default=1)
+    gen.add_argument('--seed', type=int, default=0)
+    gen.add_argument('--layout', choices=layouts, default='records',
+                     help='schema of the tower datasets (ignored with --simulate, which stores simulations)')
+    gen.add_argument('--output-dir', required=True)
+    gen.add_argument('--simulate', action='store_true', help='also simulate trajectories')
+    gen.add_argument('--duration', type=float, default=3.0)
+    gen.add_argument('--framerate', type=int, default=60)
+    gen.add_argument('--timestep', type=float, default=.001)
+    gen.add_argument('--scale-factor', type=float, default=1.0)
+    gen.add_argument('--compact', action='store_true', help='store trajectories in the compact format')
+    gen.add_argument('--cache-dir', default=None, help='simulation cache shared across runs (see block_towers.cache)')
+    gen.add_argument('--cache-max-gb', type=float, default=None, help='size cap of the cache (LRU eviction)')
+    gen.set_defaults(func=generate)
+
+    mrg = subparsers.add_parser('merge', help='assemble finished shards into a DatasetDict')
+    mrg.add_argument('--output-dir', required=True, help='directory holding the shard outputs')
+    mrg.add_argument('--save-dir', default=None, help='where to save the DatasetDict (default: <output-dir>/merged)')
+    mrg.add_argument('--test-size', type=float, default=.20)
+    mrg.set_defaults(func=merge)
+
+    return parser
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,13 @@
-from torch.nn.modules.utils import _triple
-from collections import OrderedDict
 import numpy as np
 
-import matplotlib.pyplot as plt
-from fastprogress import progress_bar
-import numpy as np
-import math
-from pdb import set_trace
-
 from .towerstats import compute_will_fall
 
+def _triple(x):
+    ''' Expand a scalar side length to (lx, ly, lz); sequences are passed through as a tuple. '''
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return tuple(x)
+    return (x, x, x)
+
 def init_block(x,y,z,lx,ly,lz,rx=0,ry=0,rz=0,mass=None,density=None):
     return dict([('x', x), ('y', y), ('z', z),       # x,y,z coordinate
                  ('lx', lx), ('ly', ly), ('lz', lz), # length of x,y,z side
@@ -21,6 +19,26 @@ def init_block(x,y,z,lx,ly,lz,rx=0,ry=0,rz=0,mass=None,density=None):
 def coords(x,y,z):
     return dict([('x', x), ('y', y), ('z', z)]);
 
+block_keys = ('x', 'y', 'z', 'lx', 'ly', 'lz', 'rx', 'ry', 'rz')
+
+def towers_to_array(list_of_positions, keys=block_keys):
+    ''' Stack towers (lists of block dicts) into a (num_towers, max_blocks, len(keys)) float array.
+
+        Towers with fewer than max_blocks blocks are padded with nan.
+    '''
+    max_blocks = max(len(positions) for positions in list_of_positions)
+    arr = np.full((len(list_of_positions), max_blocks, len(keys)), np.nan)
+    for i, positions in enumerate(list_of_positions):
+        arr[i, :len(positions)] = [[p[k] for k in keys] for p in positions]
+    return arr
+
+def array_to_towers(arr, keys=block_keys):
+    ''' Inverse of `towers_to_array`: convert a (num_towers, max_blocks, len(keys)) array
+        back to lists of block dicts, dropping nan padding.
+    '''
+    return [[dict(zip(keys, [float(v) for v in block])) for block in tower if not np.isnan(block[0])]
+            for tower in np.asarray(arr)]
+
 def bounded_random_normal(mu, std=1, lower=-0.98, upper=0.98, size=None):
     ''' Get random sample, with lower and upper bounds.
 
@@ -83,3 +101,88 @@ def gen_start_positions_cubes(numBlocks, side_length, std, truncate=.90, jitter_
     
     return positions
 
+
+def top_block_intervals(xs, side_length, band, truncate=.90):
+    ''' x intervals for the top block that put a tower's max centroid-edge distance within `band`.
+
+        xs: x positions of the blocks below the top block (bottom first)
+        band: (lower, upper) bounds on max_k d_k, where d_k = |c_k - x_{k-1}| - side_length/2 is
+              the (signed) centroid-edge distance of block k (see `compute_centroid_edge_dist`),
+              and c_k the mean x of blocks k and above
+
+        Each c_k is affine in the top block's x, so {d_k <= r} is an interval and the max over k is
+        within `band` on the intersection of the upper-bound intervals minus the intersection of the
+        (open) lower-bound intervals, clipped to +/- truncate*side_length around the block below.
+
+        Returns a list of up to two (start, stop) intervals (empty if no top position works).
+    '''
+    xs = np.asarray(xs, dtype=float)
+    num_blocks = len(xs) + 1
+    k = np.arange(1, num_blocks)
+    mk = num_blocks - k                        # blocks in the stack on top of block k-1
+    sk = np.cumsum(xs[::-1])[::-1][1:]         # sum of x over blocks k..N-2 (excluding the top block)
+    sk = np.append(sk, 0.0)
+
+    def within(margin):
+        ''' interval of top x with max_k d_k <= margin (or None) '''
+        r = margin + side_length/2
+        if r < 0:
+            return None
+        lo = np.max(mk * (xs[k-1] - r) - sk)
+        hi = np.min(mk * (xs[k-1] + r) - sk)
+        return (lo, hi) if lo <= hi else None
+
+    lower, upper = band
+    outer = within(upper)
+    if outer is None:
+        return []
+    start, stop = max(outer[0], xs[-1] - truncate*side_length), min(outer[1], xs[-1] + truncate*side_length)
+    if start > stop:
+        return []
+    inner = within(lower)
+    if inner is None:
+        return [(start, stop)]
+    intervals = [(start, min(stop, inner[0])), (max(start, inner[1]), stop)]
+    return [(a, b) for a, b in intervals if a < b]
+
+def gen_start_positions_cubes_margin(numBlocks, side_length, std, truncate=.90, band=(-.02, .02), max_tries=1000):
+    ''' Generate cube towers whose max centroid-edge distance lies within `band` (near-boundary
+        towers when the band is around 0: negative is stable, positive unstable).
+
+        The blocks below the top are jittered as in `gen_start_positions_cubes` (x only); the
+        top block's x is then drawn uniformly from the positions that put the tower in the band
+        (see `top_block_intervals`), so nearly every draw is accepted. Only when the lower blocks
+        admit no such position (rare for bands near 0) are they drawn again, up to `max_tries` times.
+
+        Blocks are labeled ('unstable') like `gen_start_positions_cubes`; usable as the gen_fun
+        of `generate_batch_initial_positions`, e.g. partial(gen_start_positions_cubes_margin, band=(0, .01)).
+    '''
+    if numBlocks < 2:
+        raise ValueError("margin-targeted sampling needs at least 2 blocks")
+    lx,ly,lz = _triple(side_length)
+    lower_x, upper_x = lx * -truncate, lx * truncate
+
+    for _ in range(max_tries):
+        xs = [0.0]
+        for block in range(1, numBlocks-1):
+            xs.append(float(bounded_random_normal(xs[-1], std, lower_x, upper_x)))
+        intervals = top_block_intervals(xs, lx, band, truncate=truncate)
+        if intervals:
+            break
+    else:
+        raise ValueError(f"no tower found with max centroid-edge distance in {band} after {max_tries} tries")
+
+    lengths = np.array([b - a for a, b in intervals])
+    start, stop = intervals[np.random.choice(len(intervals), p=lengths/lengths.sum())]
+    xs.append(float(np.random.uniform(start, stop)))
+
+    positions = []
+    for block, x in enumerate(xs):
+        z = lz/2 if block == 0 else positions[block-1]['z'] + ly
+        positions.append(init_block(x, 0, z, lx, ly, lz, 0, 0, 0))
+
+    _, isUnstable = compute_will_fall(positions)
+    for idx in range(len(positions)):
+        positions[idx]['unstable'] = int(isUnstable[idx])
+
+    return positions
@@ -1,8 +1,17 @@
 '''
     Generate BlockTowers Datasets
 '''
-from datasets import Dataset, DatasetDict, concatenate_datasets
+import os
+import json
+import shutil
+import numpy as np
+import pyarrow as pa
+from functools import partial
+from datasets import (Dataset, DatasetDict, DatasetInfo, Features, Value, ClassLabel, Array2D,
+                      concatenate_datasets, load_from_disk)
+from datasets.table import InMemoryTable
 from fastprogress import master_bar, progress_bar
+from .cubes import block_keys, towers_to_array, array_to_towers
 from .simulation import generate_batch_initial_positions, generate_trajectories_parallel
 
 from pdb import set_trace
@@ -23,7 +32,13 @@ settings2 = {
     6: dict(num_blocks=6, side_length=.40, std=.350, truncate=.60),
 }
 
-def generate_blocktower_dataset(settings, gen_fun, num_samples, pct_fall=.50, test_size=.20):
+def generate_blocktower_dataset(settings, gen_fun, num_samples, pct_fall=.50, test_size=.20, layout='records'):
+    ''' Generate stable/unstable towers for each num_blocks in `settings`, split into train/test.
+
+        `layout` selects the schema of each split (see `towers_to_dataset`): 'records' keeps
+        the towers as lists of block dicts in `data`, 'arrays' stores them as fixed-shape
+        `blocks` arrays (use `load_tower_arrays` to read them).
+    '''
     data = dict()
     for num_blocks,params in settings.items():
         stable, unstable = generate_batch_initial_positions(gen_fun, 
@@ -31,12 +46,9 @@ def generate_blocktower_dataset(settings, gen_fun, num_samples, pct_fall=.50, te
                                                             num_samples=num_samples, 
                                                             pct_fall=pct_fall)
 
-        dataset_stable = Dataset.from_dict(dict(data=stable))
-        dataset_unstable = Dataset.from_dict(dict(data=unstable))
-        
-        # Add 'label': 0 for stable, 1 for unstable
-        dataset_stable = dataset_stable.map(lambda examples: {**examples, 'label': 0, 'num_blocks': num_blocks})  
-        dataset_unstable = dataset_unstable.map(lambda examples: {**examples, 'label': 1, 'num_blocks': num_blocks})
+        # 'label': 0 for stable, 1 for unstable
+        dataset_stable = towers_to_dataset(stable, 0, num_blocks, layout=layout)
+        dataset_unstable = towers_to_dataset(unstable, 1, num_blocks, layout=layout)
     
         data[f'stack{num_blocks}_stable'] = dataset_stable.train_test_split(test_size=test_size)
         data[f'stack{num_blocks}_unstable'] = dataset_unstable.train_test_split(test_size=test_size)
@@ -45,19 +57,222 @@ def generate_blocktower_dataset(settings, gen_fun, num_samples, pct_fall=.50, te
     
     return dataset
 
-def generate_trajectory_datasets(datasets, gen_fun, splits=['train', 'test']):    
+# --------------------------------------------------------
+#  Typed schemas: every tower dataset has the same explicit
+#  Features, so nothing is inferred from the python objects
+# --------------------------------------------------------
+
+label_names = ['stable', 'unstable']
+tower_array_keys = block_keys + ('unstable',)
+layouts = ('records', 'arrays')
+
+def record_features():
+    ''' 'records' layout: `data` holds each tower as a list of block dicts. '''
+    block = {k: Value('float64') for k in block_keys + ('mass', 'density')}
+    block['unstable'] = Value('int8')
+    return Features(data=[block], label=ClassLabel(names=label_names), num_blocks=Value('int32'))
+
+def array_features(num_blocks):
+    ''' 'arrays' layout: `blocks` holds each tower as a (num_blocks, len(tower_array_keys)) float64 array. '''
+    return Features(blocks=Array2D(shape=(num_blocks, len(tower_array_keys)), dtype='float64'),
+                    label=ClassLabel(names=label_names), num_blocks=Value('int32'))
+
+def towers_to_dataset(towers, labels, num_blocks, layout='records'):
+    ''' Dataset of towers (lists of block dicts) with `label` (a scalar or one per tower) and
+        `num_blocks` columns, in the given layout.
+
+        The 'arrays' layout is built straight from one numpy array into Arrow buffers, with
+        no per-row python conversion.
+    '''
+    labels = np.broadcast_to(np.asarray(labels, dtype=np.int64), (len(towers),))
+    if layout == 'records':
+        return Dataset.from_dict(dict(data=towers, label=labels.tolist(), num_blocks=[num_blocks] * len(towers)),
+                                 features=record_features())
+    if layout != 'arrays':
+        raise ValueError(f"unknown layout {layout!r}, expected one of {layouts}")
+
+    features = array_features(num_blocks)
+    num_keys = len(tower_array_keys)
+    arr = towers_to_array(towers, keys=tower_array_keys) if len(towers) else np.empty((0, num_blocks, num_keys))
+    if arr.shape[1:] != (num_blocks, num_keys) or np.isnan(arr[..., 0]).any():
+        raise ValueError(f"the arrays layout needs towers of exactly {num_blocks} blocks")
+
+    num_towers = len(arr)
+    rows = pa.ListArray.from_arrays(pa.array(np.arange(0, num_towers*num_blocks*num_keys + 1, num_keys, dtype=np.int32)),
+                                    pa.array(arr.reshape(-1)))
+    towers = pa.ListArray.from_arrays(pa.array(np.arange(0, num_towers*num_blocks + 1, num_blocks, dtype=np.int32)), rows)
+    table = pa.table(dict(
+        blocks=pa.ExtensionArray.from_storage(features['blocks'](), towers),
+        label=pa.array(labels),
+        num_blocks=pa.array(np.full(num_towers, num_blocks, dtype=np.int32)),
+    ), schema=features.arrow_schema)
+    return Dataset(InMemoryTable(table), info=DatasetInfo(features=features))
+
+def load_tower_arrays(dataset):
+    ''' The columns of a tower dataset (either layout, or the path of one saved with
+        save_to_disk) as numpy arrays: blocks (B, N, len(tower_array_keys)) float64, label (B,)
+        and num_blocks (B,).
+
+        For the arrays layout the blocks are read straight from the (memory-mapped) Arrow
+        buffers, without going through python objects; records are converted with
+        `towers_to_array` (nan-padded to the largest tower).
+    '''
+    if isinstance(dataset, str):
+        dataset = load_from_disk(dataset)
+    table = dataset.with_format('arrow')[:]
+    arrays = dict(label=table.column('label').to_numpy(), num_blocks=table.column('num_blocks').to_numpy())
+    if 'blocks' not in table.column_names:
+        arrays['blocks'] = towers_to_array(dataset['data'], keys=tower_array_keys)
+        return arrays
+
+    shape = dataset.features['blocks'].shape
+    chunks = [chunk.storage.flatten().flatten().to_numpy() for chunk in table.column('blocks').chunks]
+    values = chunks[0] if len(chunks) == 1 else np.concatenate(chunks) if chunks else np.empty(0)
+    arrays['blocks'] = values.reshape((len(table),) + tuple(shape))
+    return arrays
+
+def get_towers(dataset):
+    ''' The towers of a dataset in either layout, as lists of block dicts. '''
+    if 'data' in dataset.column_names:
+        return dataset['data']
+    towers = array_to_towers(load_tower_arrays(dataset)['blocks'], keys=tower_array_keys)
+    for positions in towers:
+        for block in positions:
+            block['unstable'] = int(block['unstable'])
+    return towers
+
+summary_columns = ['fell', 'fall_time', 'final_displacement', 'max_velocity']
+
+def generate_trajectory_datasets(datasets, gen_fun, splits=['train', 'test'], output_dir=None, shard_size=1000):
+    ''' Simulate a trajectory for every tower in `datasets` (a dict of DatasetDicts).
+
+        By default everything is kept in memory until the end. If `output_dir` is given,
+        each split is simulated in shards of `shard_size` towers; every finished shard is
+        saved under `output_dir/<config_name>/<split>/` and recorded in
+        `output_dir/manifest.json` together with the gen_fun settings and a fingerprint
+        of the input split. Rerunning with the same arguments skips finished shards,
+        so a preempted run continues from its last checkpoint.
+
+        The input splits may use either layout (see `towers_to_dataset`). Each output split has
+        the simulations in `data`, `label`, `num_blocks`, and the flat outcome columns in
+        `summary_columns` (see `block_towers.simulation.finalize_outcome_summary`).
+    '''
+    manifest = None
+    if output_dir is not None:
+        manifest = load_manifest(output_dir, gen_fun, shard_size)
+
     mb = master_bar(datasets.items())
     new_datasets = dict()
     for config_name, dataset in mb:
         dsets = dict()
         for split in progress_bar(splits, parent=mb):
-            start_positions = dataset[split]['data']
-            simulations, _ = generate_trajectories_parallel(gen_fun, start_positions)
-            
-            dsets[split] = Dataset.from_dict(
-                dict(data=simulations, label=dataset[split]['label'], num_blocks=dataset[split]['num_blocks'])
-            )
-            
+            if manifest is None:
+                dsets[split] = simulate_split(dataset[split], gen_fun, mb=mb)
+            else:
+                dsets[split] = simulate_split_checkpointed(dataset[split], gen_fun, output_dir, manifest,
+                                                           config_name, split, mb=mb)
+
         new_datasets[config_name] = DatasetDict(dsets)
-    
-    return DatasetDict(new_datasets)
\ No newline at end of file
+
+    return DatasetDict(new_datasets)
+
+def simulate_split(dataset, gen_fun, mb=None):
+    start_positions = get_towers(dataset)
+    simulations, _ = generate_trajectories_parallel(gen_fun, start_positions, mb=mb)
+
+    # outcome summaries are also stored as flat columns, so queries and label audits
+    # can filter on them without decoding the trajectories
+    columns = dict(data=simulations, label=dataset['label'], num_blocks=dataset['num_blocks'])
+    for key in summary_columns:
+        columns[key] = [simulation['summary'][key] for simulation in simulations]
+
+    return Dataset.from_dict(columns)
+
+def simulate_split_checkpointed(dataset, gen_fun, output_dir, manifest, config_name, split, mb=None):
+    shard_size = manifest['shard_size']
+    num_shards = max(1, -(-len(dataset) // shard_size))
+    fingerprint = getattr(dataset, '_fingerprint', None)
+
+    entry = manifest['configs'].setdefault(config_name, dict()).setdefault(split, dict(
+        fingerprint=fingerprint, num_rows=len(dataset), num_shards=num_shards, done=[],
+    ))
+    if entry['num_rows'] != len(dataset) or entry['fingerprint'] != fingerprint:
+        raise ValueError(f"{config_name}/{split} does not match the dataset recorded in "
+                         f"{manifest_path(output_dir)}; use a new output_dir to start over")
+    save_manifest(output_dir, manifest)
+
+    split_dir = os.path.join(output_dir, config_name, split)
+    for shard_idx in range(num_shards):
+        if shard_idx in entry['done']:
+            continue
+        start = shard_idx * shard_size
+        shard = dataset.select(range(start, min(start + shard_size, len(dataset))))
+        shard_path = os.path.join(split_dir, f'shard-{shard_idx:05d}')
+
+        save_dataset_atomic(simulate_split(shard, gen_fun, mb=mb), shard_path)
+
+        entry['done'] = sorted(entry['done'] + [shard_idx])
+        save_manifest(output_dir, manifest)
+
+    shards = [load_from_disk(os.path.join(split_dir, f'shard-{shard_idx:05d}')) for shard_idx in range(num_shards)]
+    return concatenate_datasets(shards)
+
+# --------------------------------------------------------
+#  Checkpoint manifest
+# --------------------------------------------------------
+
+def manifest_path(output_dir, name='manifest'):
+    return os.path.join(output_dir, f'{name}.json')
+
+def save_dataset_atomic(dataset, path):
+    ''' save_to_disk via a temporary directory, so a crash never leaves a partial dataset at `path`. '''
+    tmp_path = path + '.tmp'
+    for p in (tmp_path, path):
+        if os.path.exists(p): shutil.rmtree(p)
+    dataset.save_to_disk(tmp_path)
+    os.replace(tmp_path, path)
+
+def describe_gen_fun(gen_fun):
+    ''' JSON-friendly description of gen_fun (usually a functools.partial of generate_trajectory),
+        stable across processes so it can be compared when resuming.
+    '''
+    if isinstance(gen_fun, partial):
+        return dict(func=describe_gen_fun(gen_fun.func),
+                    args=[describe_gen_fun(arg) for arg in gen_fun.args],
+                    keywords={k: describe_gen_fun(v) for k,v in gen_fun.keywords.items()})
+    if isinstance(gen_fun, dict):
+        return {str(k): describe_gen_fun(v) for k,v in gen_fun.items()}
+    if isinstance(gen_fun, (list, tuple)):
+        return [describe_gen_fun(v) for v in gen_fun]
+    if callable(gen_fun):
+        return f"{getattr(gen_fun, '__module__', '')}.{getattr(gen_fun, '__qualname__', repr(gen_fun))}"
+    if gen_fun is None or isinstance(gen_fun, (bool, int, float, str)):
+        return gen_fun
+    return repr(gen_fun)
+
+def load_manifest(output_dir, gen_fun, shard_size):
+    ''' Load the manifest in `output_dir`, or start a new one.
+
+        Raises a ValueError if the existing manifest was written with different settings,
+        because mixing shards from two configurations would silently corrupt the dataset.
+    '''
+    settings = dict(gen_fun=describe_gen_fun(gen_fun), shard_size=shard_size)
+    path = manifest_path(output_dir)
+    if not os.path.exists(path):
+        os.makedirs(output_dir, exist_ok=True)
+        return dict(version=1, **settings, configs=dict())
+
+    with open(path) as f:
+        manifest = json.load(f)
+    for key, value in settings.items():
+        if manifest.get(key) != value:
+            raise ValueError(f"{path} was written with a different {key} "
+                             f"({manifest.get(key)!r} != {value!r}); use a new output_dir to start over")
+    return manifest
+
+def save_manifest(output_dir, manifest, name='manifest'):
+    path = manifest_path(output_dir, name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
@@ -0,0 +1,196 @@
+'''
+    Random-access storage for simulated trajectories.
+
+    A frame store is a directory of flat, fixed-shape binary arrays holding the
+    poses of every frame of every tower, plus an offset index:
+
+        meta.json           number of towers/frames, max_blocks, array dtypes
+        offsets.bin         int64 (num_towers+1,): frames of tower i are rows offsets[i]:offsets[i+1]
+        num_blocks.bin      int32 (num_towers,)
+        framerate.bin       float64 (num_towers,)
+        label.bin           int64 (num_towers,), -1 if unknown
+        xyz.bin             float32 (num_frames, max_blocks, 3), zero padded
+        quat.bin            float32 (num_frames, max_blocks, 4), w x y z, zero padded
+        t.bin               float64 (num_frames,)
+        physics_step.bin    int64 (num_frames,)
+        video_frame.bin     int64 (num_frames,)
+
+    The reader memory-maps these arrays, so fetching frame t of tower i (or a
+    strided subsequence) only touches the rows it needs instead of decoding the
+    whole nested `trajectory` of a HF dataset row.
+'''
+import os
+import json
+import numpy as np
+from fastprogress import progress_bar
+
+from .trajectory import trajectory_to_arrays, densify_arrays, quat_to_xmat
+
+frame_fields = dict(
+    xyz=('float32', 3),
+    quat=('float32', 4),
+    t=('float64', None),
+    physics_step=('int64', None),
+    video_frame=('int64', None),
+)
+
+tower_fields = dict(
+    num_blocks='int32',
+    framerate='float64',
+    label='int64',
+)
+
+class FrameStoreWriter(object):
+    ''' Append simulations to a frame store directory.
+
+        Arrays are streamed to disk as towers are added; the index is written by `close()`.
+        Trajectories recorded with keyframes are stored at the full frame rate (see `densify_arrays`).
+    '''
+    def __init__(self, path, max_blocks):
+        self.path = path
+        self.max_blocks = max_blocks
+        self.offsets = [0]
+        self.towers = {name: [] for name in tower_fields}
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, f'{name}.bin'), 'wb') for name in frame_fields}
+
+    def add(self, simulation, label=-1):
+        arrays = densify_arrays(trajectory_to_arrays(simulation['trajectory']), simulation['params'])
+        num_frames, num_blocks, _ = arrays['xyz'].shape
+        if num_blocks > self.max_blocks:
+            raise ValueError(f"tower has {num_blocks} blocks, but the store was created with max_blocks={self.max_blocks}")
+
+        for name, (dtype, width) in frame_fields.items():
+            values = arrays[name]
+            if width is not None:
+                padded = np.zeros((num_frames, self.max_blocks, width), dtype=dtype)
+                padded[:, :num_blocks] = values
+                values = padded
+            self.files[name].write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+        self.offsets.append(self.offsets[-1] + num_frames)
+        self.towers['num_blocks'].append(num_blocks)
+        self.towers['framerate'].append(simulation['params']['framerate'])
+        self.towers['label'].append(label)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        np.asarray(self.offsets, dtype='int64').tofile(os.path.join(self.path, 'offsets.bin'))
+        for name, dtype in tower_fields.items():
+            np.asarray(self.towers[name], dtype=dtype).tofile(os.path.join(self.path, f'{name}.bin'))
+
+        meta = dict(num_towers=len(self.offsets)-1, num_frames=self.offsets[-1], max_blocks=self.max_blocks,
+                    frame_fields=frame_fields, tower_fields=tower_fields)
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def write_frame_store(simulations, path, labels=None, max_blocks=None, mb=None):
+    ''' Write a list of simulations (from `generate_trajectory`) to a frame store at `path`. '''
+    if max_blocks is None:
+        max_blocks = max(len(sim['start_positions']) for sim in simulations)
+    if labels is None:
+        labels = [-1] * len(simulations)
+
+    with FrameStoreWriter(path, max_blocks) as writer:
+        for simulation, label in zip(progress_bar(simulations, parent=mb), labels):
+            writer.add(simulation, label=label)
+
+    return FrameStore(path)
+
+def write_frame_store_from_dataset(dataset, path, max_blocks=None, mb=None):
+    ''' Convert a HF trajectory dataset (as written by `generate_trajectory_datasets`,
+        with `data` and `label` columns) to a frame store at `path`.
+
+        Rows are decoded one at a time, so the conversion runs in constant memory.
+    '''
+    if max_blocks is None:
+        max_blocks = max(dataset['num_blocks'])
+
+    with FrameStoreWriter(path, max_blocks) as writer:
+        for row in progress_bar(dataset, parent=mb):
+            writer.add(row['data'], label=row.get('label', -1))
+
+    return FrameStore(path)
+
+class FrameStore(object):
+    ''' Read-only random access to a frame store written by `FrameStoreWriter`.
+
+        store = FrameStore(path)
+        frame = store.get_frame(i, t)                    # frame t of tower i
+        clip = store.get_frames(i, 0, None, step=2)      # every other frame
+        clip = store.get_subsequence(i, framerate=15)    # resampled to 15 fps
+
+        Arrays are memory-mapped on first access (per process, so a FrameStore
+        can be handed to DataLoader workers).
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.max_blocks = self.meta['max_blocks']
+        self.offsets = np.fromfile(os.path.join(path, 'offsets.bin'), dtype='int64')
+        for name, dtype in self.meta['tower_fields'].items():
+            setattr(self, name, np.fromfile(os.path.join(path, f'{name}.bin'), dtype=dtype))
+        self._arrays = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_arrays'] = None
+        return state
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            num_frames = self.meta['num_frames']
+            self._arrays = dict()
+            for name, (dtype, width) in self.meta['frame_fields'].items():
+                shape = (num_frames,) if width is None else (num_frames, self.max_blocks, width)
+                self._arrays[name] = np.memmap(os.path.join(self.path, f'{name}.bin'), dtype=dtype,
+                                               mode='r', shape=shape)
+        return self._arrays
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def num_frames(self, index):
+        return int(self.offsets[index+1] - self.offsets[index])
+
+    def get_frames(self, index, start=0, stop=None, step=1, as_xmat=False):
+        ''' Frames start:stop:step of tower `index`, as a dict of arrays
+            (xyz (k,N,3), quat (k,N,4) or xmat (k,N,9), t, physics_step, video_frame).
+        '''
+        rows = slice(*slice(start, stop, step).indices(self.num_frames(index)))
+        rows = slice(self.offsets[index] + rows.start, self.offsets[index] + rows.stop, rows.step)
+        num_blocks = self.num_blocks[index]
+
+        frames = dict()
+        for name, (_, width) in self.meta['frame_fields'].items():
+            values = self.arrays[name][rows]
+            frames[name] = np.array(values if width is None else values[:, :num_blocks])
+        if as_xmat:
+            frames['xmat'] = quat_to_xmat(frames.pop('quat')).astype('float32')
+
+        return frames
+
+    def get_frame(self, index, t, as_xmat=False):
+        ''' Frame `t` of tower `index` (negative t counts from the end). '''
+        if t < 0:
+            t += self.num_frames(index)
+        if not 0 <= t < self.num_frames(index):
+            raise IndexError(f"frame {t} out of range for tower {index} ({self.num_frames(index)} frames)")
+        frames = self.get_frames(index, t, t+1, as_xmat=as_xmat)
+        return {name: values[0] for name, values in frames.items()}
+
+    def get_subsequence(self, index, framerate, start=0, stop=None, as_xmat=False):
+        ''' Frames of tower `index` subsampled to `framerate` (must divide the stored framerate). '''
+        step = self.framerate[index] / framerate
+        if step < 1 or abs(step - round(step)) > 1e-6:
+            raise ValueError(f"framerate {framerate} must evenly divide the stored framerate {self.framerate[index]}")
+        return self.get_frames(index, start, stop, int(round(step)), as_xmat=as_xmat)
@@ -0,0 +1,185 @@
+'''
+    PyTorch datasets that render towers on the fly.
+
+    Each DataLoader worker builds its own physics engines (one per tower structure,
+    i.e. number and sizes of blocks and static/dynamic model, created lazily) and
+    a reusable camera, so workers never share GL state and the world model is
+    compiled once per structure and worker rather than once per item. `__getitems__`
+    fetches a whole batch in one call: each tower is still its own `Camera.render`,
+    but it only re-poses the boxes of its structure's engine, and `sizes` pyramids
+    are downsampled for the batch at once. Items are uint8 CHW tensors, ready for pin_memory:
+
+        dataset = TowerRenderDataset(dataset['stack6_unstable']['train']['data'], xml_fun)
+        loader = DataLoader(dataset, batch_size=64, num_workers=8, pin_memory=True,
+                            worker_init_fn=worker_init_fn, persistent_workers=True)
+
+    `TrajectoryFrameDataset` renders the frames of simulated towers in the same way,
+    with poses read from a frame store (see `block_towers.frame_store`).
+'''
+import os
+import numpy as np
+import torch
+from torch.utils.data import Dataset, get_worker_info
+from dm_control import mujoco
+
+from .render import default_render_opts, pyramid_sizes, render_pyramid
+
+camera_opts = ('height', 'width', 'camera_id')
+
+def worker_init_fn(worker_id):
+    ''' DataLoader worker_init_fn: gives the worker's copy of the dataset fresh (lazily built) physics. '''
+    dataset = get_worker_info().dataset
+    if hasattr(dataset, 'init_worker'):
+        dataset.init_worker()
+
+class TowerRenderDataset(Dataset):
+    ''' Render the start positions of towers.
+
+        start_positions_list: list of towers (lists of block dicts), e.g. dataset[split]['data']
+        xml_fun: world model generator, e.g. generate_xml_model_from_start_positions
+        labels: per-tower labels (default: 1 if any block is 'unstable', else 0)
+        scale_factor: positions and sizes are divided by this (as in generate_trajectory)
+        render_opts: height/width/camera_id, plus any other `Camera.render` options
+
+        Returns (image, label) with image a uint8 tensor (3, H, W), or whatever
+        `transform` returns for the (H, W, 3) uint8 array.
+
+        With a `sizes` list of (height, width) in render_opts (instead of height/width), each
+        tower is rendered once at the largest size and area-downsampled to the others, and
+        image is a dict {(height, width): image} (see `block_towers.render.make_renderer`).
+    '''
+    def __init__(self, start_positions_list, xml_fun, labels=None, scale_factor=1.0,
+                 render_opts=default_render_opts, transform=None):
+        self.samples = start_positions_list
+        self.xml_fun = xml_fun
+        self.labels = labels
+        self.scale_factor = scale_factor
+        self.sizes = None
+        if 'sizes' in render_opts:
+            self.sizes = pyramid_sizes(render_opts['sizes'])
+            height, width = self.sizes[0]
+            render_opts = {**{k: v for k,v in render_opts.items() if k != 'sizes'}, 'height': height, 'width': width}
+        self.render_opts = render_opts
+        self.transform = transform
+        self.init_worker()
+
+    def init_worker(self):
+        self._pid = os.getpid()
+        self._engines = dict()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_engines'] = dict()
+        return state
+
+    def __len__(self):
+        return len(self.samples)
+
+    def get_label(self, index):
+        if self.labels is not None:
+            return self.labels[index]
+        return int(any(p.get('unstable', 0) for p in self.samples[index]))
+
+    def engine_key(self, positions):
+        ''' What the world model is built from, apart from block positions: the number and sizes of
+            the blocks (which also place the camera and lookhere target) and static vs. dynamic. '''
+        sizes = tuple((p['lx'], p['ly'], p['lz']) for p in positions)
+        return len(positions), sizes, any(p.get('unstable', 0) for p in positions)
+
+    def get_engine(self, positions):
+        ''' (physics, camera, box_ids) for towers with this structure (see `engine_key`),
+            built on first use in this process. '''
+        if os.getpid() != self._pid:
+            # forked without worker_init_fn: never reuse the parent's GL contexts
+            self.init_worker()
+
+        key = self.engine_key(positions)
+        if key not in self._engines:
+            physics = mujoco.Physics.from_xml_string(self.xml_fun(self.scale(positions)))
+            physics.forward()
+            camera = mujoco.Camera(physics, **{k: v for k,v in self.render_opts.items() if k in camera_opts})
+            box_ids = [physics.model.name2id(f'box{idx}', 'geom') for idx in range(len(positions))]
+            self._engines[key] = (physics, camera, box_ids)
+
+        return self._engines[key]
+
+    def scale(self, positions):
+        return [{k:v/self.scale_factor if isinstance(v,(int,float)) else v for k,v in pos.items()} for pos in positions]
+
+    def set_tower(self, physics, box_ids, positions):
+        ''' Pose (and size) the engine's boxes to match `positions`. '''
+        arr = np.array([[p['x'], p['y'], p['z'], p['lx'], p['ly'], p['lz']] for p in positions]) / self.scale_factor
+        physics.data.geom_xpos[box_ids] = arr[:, :3]
+        physics.data.geom_xmat[box_ids] = np.eye(3).flatten()
+        physics.model.geom_size[box_ids] = arr[:, 3:] / 2
+
+    def pose_engine(self, index):
+        ''' Set up the engine for item `index`; returns its camera. '''
+        positions = self.samples[index]
+        physics, camera, box_ids = self.get_engine(positions)
+        self.set_tower(physics, box_ids, positions)
+        return camera
+
+    def render_batch(self, indices):
+        ''' Render the towers at `indices` into a (B, H, W, 3) uint8 array, one render per tower. '''
+        render_kwargs = {k: v for k,v in self.render_opts.items() if k not in camera_opts}
+        pixels = None
+        for i, index in enumerate(indices):
+            img = self.pose_engine(index).render(**render_kwargs)
+            if pixels is None:
+                pixels = np.empty((len(indices),) + img.shape, dtype=img.dtype)
+            pixels[i] = img
+        return pixels
+
+    def to_item(self, img):
+        if self.transform is not None:
+            return self.transform(np.ascontiguousarray(img))
+        return torch.from_numpy(img).permute(2, 0, 1).contiguous()
+
+    def __getitems__(self, indices):
+        pixels = self.render_batch(indices)
+        if self.sizes is not None:
+            # the whole batch is downsampled at once
+            pyramid = render_pyramid(pixels, self.sizes)
+            return [({size: self.to_item(imgs[i]) for size, imgs in pyramid.items()}, self.get_label(index))
+                    for i, index in enumerate(indices)]
+        return [(self.to_item(img), self.get_label(index)) for img, index in zip(pixels, indices)]
+
+    def __getitem__(self, index):
+        return self.__getitems__([index])[0]
+
+class TrajectoryFrameDataset(TowerRenderDataset):
+    ''' Render frames of simulated towers, with the poses read from a frame store.
+
+        store: `block_towers.frame_store.FrameStore` of the simulations
+        start_positions_list: start positions of the same towers, in store order (block sizes and
+            world model), e.g. [simulation['start_positions'] for simulation in simulations]
+        frame_step: items are every frame_step-th frame of every tower
+        labels: per-tower labels (default: the labels in the store)
+
+        Returns (image, label) per frame, as `TowerRenderDataset` (including `sizes` pyramids).
+        Simulations store scaled positions, so scale_factor is 1 here.
+    '''
+    def __init__(self, store, start_positions_list, xml_fun, frame_step=1, labels=None,
+                 render_opts=default_render_opts, transform=None):
+        super().__init__(start_positions_list, xml_fun, labels=store.label if labels is None else labels,
+                         render_opts=render_opts, transform=transform)
+        self.store = store
+        self.frames = np.array([(tower, t) for tower in range(len(store))
+                                for t in range(0, store.num_frames(tower), frame_step)], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_label(self, index):
+        return int(self.labels[self.frames[index, 0]])
+
+    def pose_engine(self, index):
+        tower, t = self.frames[index]
+        positions = self.samples[tower]
+        physics, camera, box_ids = self.get_engine(positions)
+        self.set_tower(physics, box_ids, positions)
+        frame = self.store.get_frame(tower, t, as_xmat=True)
+        physics.data.geom_xpos[box_ids] = frame['xyz']
+        physics.data.geom_xmat[box_ids] = frame['xmat']
+        return camera
@@ -0,0 +1,147 @@
+'''
+    GL-free orthographic side-view renderer.
+
+    Rasterizes block towers straight into uint8 pixel arrays with vectorized
+    numpy, for whole batches at once. The view matches `show_tower_grid`: the
+    camera looks along +y, image columns are world x and image rows are world z
+    (up). Boxes are drawn as the exact silhouette of their orthographic
+    projection, so rotated boxes from stored poses work as well as the
+    axis-aligned start positions.
+
+    This is much cheaper than `physics.render` (no lighting, textures or
+    perspective), which makes it suitable for generating very large numbers of
+    simple stimuli on CPU-only nodes.
+'''
+import numpy as np
+
+from .cubes import towers_to_array
+from .trajectory import trajectory_to_arrays, densify_arrays, quat_to_xmat
+from .world_models.towers_v1 import default_colors
+
+stability_colors = dict(stable=(0, 0, 255), unstable=(255, 0, 0))  # matches show_tower_grid (blue/red)
+
+def block_colors(num_blocks, colors=default_colors):
+    ''' uint8 rgb colors (num_blocks, 3) from a list of rgba float colors (as used by the world models). '''
+    return np.round(np.asarray(colors[:num_blocks], dtype=np.float64)[:, :3] * 255).astype(np.uint8)
+
+def default_extent(half_sizes, height, width):
+    ''' World-space (xmin, xmax, zmin, zmax) shown in the image.
+
+        Like `show_tower_grid`, the view spans 10 side lengths vertically (starting at the floor)
+        and is centered on x=0; the horizontal span follows the image aspect ratio so pixels are square.
+    '''
+    side_length = 2 * float(half_sizes[0, 0, 0])
+    zspan = 10 * side_length
+    xspan = zspan * width / height
+    return (-xspan/2, xspan/2, 0.0, zspan)
+
+def rasterize_boxes(xyz, half_sizes, colors, xmat=None, mask=None, height=360, width=480, extent=None,
+                    background=(255, 255, 255), batch_size=32):
+    ''' Rasterize a batch of boxes into (B, H, W, 3) uint8 images.
+
+        xyz: (B, N, 3) box centers
+        half_sizes: (B, N, 3) half side lengths along the box axes
+        colors: (N, 3) or (B, N, 3) uint8 colors
+        xmat: (B, N, 9) row-major rotation matrices, or None for axis-aligned boxes
+        mask: (B, N) bool, False for padding blocks
+        extent: (xmin, xmax, zmin, zmax) in world units; see `default_extent`
+
+        The projection of a box along y is a zonotope (the Minkowski sum of its three projected
+        half-axes), so a pixel is inside iff its offset from the center, projected onto the normal
+        of each half-axis, is within that normal's support. Overlaps are resolved with a depth
+        buffer on the box centers (smaller y is closer to the camera).
+    '''
+    xyz = np.asarray(xyz, dtype=np.float32)
+    half_sizes = np.asarray(half_sizes, dtype=np.float32)
+    num_towers, num_blocks, _ = xyz.shape
+    colors = np.broadcast_to(np.asarray(colors, dtype=np.uint8), (num_towers, num_blocks, 3))
+    if mask is None:
+        mask = np.ones((num_towers, num_blocks), dtype=bool)
+    if xmat is None:
+        rot = np.broadcast_to(np.eye(3, dtype=np.float32), (num_towers, num_blocks, 3, 3))
+    else:
+        rot = np.asarray(xmat, dtype=np.float32).reshape(num_towers, num_blocks, 3, 3)
+    if extent is None:
+        extent = default_extent(half_sizes, height, width)
+
+    # projected half-axes: the x and z components of each rotated box axis (columns of rot)
+    gens = np.stack([rot[..., 0, :], rot[..., 2, :]], axis=-1) * half_sizes[..., None]  # (B, N, 3, 2)
+    normals = np.stack([-gens[..., 1], gens[..., 0]], axis=-1)
+    support = np.abs(np.einsum('bnkd,bnjd->bnkj', normals, gens)).sum(-1) + 1e-6  # (B, N, 3)
+
+    xmin, xmax, zmin, zmax = extent
+    px = (xmin + (np.arange(width) + 0.5) * (xmax - xmin) / width).astype(np.float32)
+    pz = (zmax - (np.arange(height) + 0.5) * (zmax - zmin) / height).astype(np.float32)
+
+    images = np.empty((num_towers, height, width, 3), dtype=np.uint8)
+    images[:] = np.asarray(background, dtype=np.uint8)
+    for start in range(0, num_towers, batch_size):
+        b = slice(start, start + batch_size)
+        image = images[b]
+        depth = np.full(image.shape[:3], np.inf, dtype=np.float32)
+        for n in range(num_blocks):
+            dx = px[None, None, :] - xyz[b, n, 0, None, None]
+            dz = pz[None, :, None] - xyz[b, n, 2, None, None]
+            inside = mask[b, n, None, None] & (xyz[b, n, 1, None, None] < depth)
+            for k in range(3):
+                proj = normals[b, n, k, 0, None, None] * dx + normals[b, n, k, 1, None, None] * dz
+                inside &= np.abs(proj) <= support[b, n, k, None, None]
+            depth[inside] = np.broadcast_to(xyz[b, n, 1, None, None], depth.shape)[inside]
+            image[inside] = np.broadcast_to(colors[b, n, None, None], image.shape)[inside]
+
+    return images
+
+def rasterize_towers(list_of_positions, height=360, width=480, extent=None, colors=default_colors,
+                     color_by_stability=False, background=(255, 255, 255), batch_size=32):
+    ''' Rasterize towers given as lists of block dicts (start positions, as passed to the
+        world models and `show_tower_grid`) into (B, H, W, 3) uint8 images.
+
+        Towers may have different numbers of blocks. Blocks are axis-aligned (the world
+        models ignore rx/ry/rz too). With `color_by_stability`, blocks are colored like
+        `show_tower_grid` (red if 'unstable', else blue) instead of by `colors`.
+    '''
+    arr = towers_to_array(list_of_positions, keys=('x', 'y', 'z', 'lx', 'ly', 'lz'))
+    mask = ~np.isnan(arr[..., 0])
+    arr = np.nan_to_num(arr)
+
+    if color_by_stability:
+        unstable = towers_to_array(list_of_positions, keys=('unstable',))[..., 0] == 1
+        block_rgb = np.where(unstable[..., None], stability_colors['unstable'], stability_colors['stable'])
+    else:
+        block_rgb = block_colors(arr.shape[1], colors)
+
+    return rasterize_boxes(arr[..., :3], arr[..., 3:] / 2, block_rgb, mask=mask, height=height, width=width,
+                           extent=extent, background=background, batch_size=batch_size)
+
+def rasterize_tower(positions, **kwargs):
+    ''' Rasterize a single tower into a (H, W, 3) uint8 image (see `rasterize_towers`). '''
+    return rasterize_towers([positions], **kwargs)[0]
+
+def rasterize_simulation(simulation, frames=None, height=360, width=480, extent=None, colors=default_colors,
+                         background=(255, 255, 255), batch_size=32):
+    ''' Rasterize the stored poses of a simulation (from `generate_trajectory`, either trajectory
+        format) into (T, H, W, 3) uint8 images; `frames` optionally selects frame indices.
+    '''
+    arrays = densify_arrays(trajectory_to_arrays(simulation['trajectory']), simulation['params'])
+    xyz, quat = arrays['xyz'], arrays['quat']
+    if frames is not None:
+        xyz, quat = xyz[frames], quat[frames]
+
+    sizes = towers_to_array([simulation['start_positions']], keys=('lx', 'ly', 'lz'))
+    half_sizes = np.broadcast_to(sizes / 2, xyz.shape)
+
+    return rasterize_boxes(xyz, half_sizes, block_colors(xyz.shape[1], colors), xmat=quat_to_xmat(quat),
+                           height=height, width=width, extent=extent, background=background, batch_size=batch_size)
+
+def rasterize_physics(physics, height=360, width=480, extent=None, colors=default_colors, background=(255, 255, 255)):
+    ''' Rasterize the current state of a physics engine (as passed to `render_image`)
+        into a (H, W, 3) uint8 image, using the poses and sizes of its box geoms.
+    '''
+    names = [name for name in physics.named.data.geom_xpos.axes.row.names if name.startswith('box')]
+    ids = [physics.model.name2id(name, 'geom') for name in names]
+    xyz = np.asarray(physics.data.geom_xpos[ids])[None]
+    xmat = np.asarray(physics.data.geom_xmat[ids])[None]
+    half_sizes = np.asarray(physics.model.geom_size[ids])[None]
+
+    return rasterize_boxes(xyz, half_sizes, block_colors(len(ids), colors), xmat=xmat,
+                           height=height, width=width, extent=extent, background=background)[0]
@@ -1,28 +1,152 @@
-import PIL
+import PIL.Image
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-import matplotlib.animation as animation
 from dm_control import mujoco
-from IPython.display import HTML
+from dm_control.mujoco import wrapper
 from math import ceil
+from functools import lru_cache
 
+from .trajectory import densify_trajectory
 # from .towerstats import compute_will_fall
 
 default_render_opts = dict(height=360,width=480,camera_id="closeup")
 
 def render_first_frame(physics, render_opts=default_render_opts):
     physics.reset()
-    pixels = physics.render(**render_opts)
-    image = PIL.Image.fromarray(pixels)
-    return image
+    return render_image(physics, render_opts)
 
 def render_image(physics, render_opts=default_render_opts):
-    pixels = physics.render(**render_opts)
+    ''' Render the current state of `physics` as a PIL image; with `sizes` in render_opts,
+        a dict {(height, width): image} from a single render (see `make_renderer`). '''
+    pixels = make_renderer(physics, render_opts)()
+    if 'sizes' in render_opts:
+        return {size: PIL.Image.fromarray(img) for size, img in pixels.items()}
     image = PIL.Image.fromarray(pixels)
     return image
 
+class MultiViewRenderer(object):
+    ''' Render several fixed cameras of the same physics state in one pass.
+
+        `physics.render` rebuilds the whole scene (all geoms, lights, ...) for every call, so
+        rendering V viewpoints costs V scene updates. Here the scene is updated once per
+        `render()` and only the camera is updated between views. Returns (V, H, W, 3) uint8.
+
+        renderer = MultiViewRenderer(physics, ['view0', 'view1', 'view2', 'view3'])
+        pixels = renderer.render()
+    '''
+    def __init__(self, physics, camera_ids, height=360, width=480, max_geom=None):
+        buffer_width = physics.model.vis.global_.offwidth
+        buffer_height = physics.model.vis.global_.offheight
+        if width > buffer_width or height > buffer_height:
+            raise ValueError(f"Image size {height}x{width} exceeds the offscreen framebuffer "
+                             f"({buffer_height}x{buffer_width}); set <visual><global offwidth/offheight> in the model XML")
+
+        self.physics = physics
+        self.height = height
+        self.width = width
+        self.cameras = []
+        for camera_id in camera_ids:
+            if isinstance(camera_id, str):
+                camera_id = physics.model.name2id(camera_id, 'camera')
+            camera = wrapper.MjvCamera()
+            camera.type = mujoco.mjtCamera.mjCAMERA_FIXED
+            camera.fixedcamid = camera_id
+            self.cameras.append(camera)
+
+        self._scene = wrapper.MjvScene(model=physics.model, max_geom=max_geom)
+        self._scene_option = wrapper.MjvOption()
+        self._perturb = wrapper.MjvPerturb()
+        self._perturb.active = 0
+        self._perturb.select = 0
+        self._rect = mujoco.MjrRect(0, 0, width, height)
+        self._rgb_buffer = np.empty((height, width, 3), dtype=np.uint8)
+
+    def render(self, out=None):
+        if out is None:
+            out = np.empty((len(self.cameras), self.height, self.width, 3), dtype=np.uint8)
+
+        mujoco.mjv_updateScene(self.physics.model.ptr, self.physics.data.ptr, self._scene_option.ptr,
+                               self._perturb.ptr, self.cameras[0].ptr, mujoco.mjtCatBit.mjCAT_ALL, self._scene.ptr)
+        with self.physics.contexts.gl.make_current() as ctx:
+            ctx.call(self._render_on_gl_thread, out)
+
+        return out
+
+    def _render_on_gl_thread(self, out):
+        context = self.physics.contexts.mujoco.ptr
+        for idx, camera in enumerate(self.cameras):
+            if idx > 0:
+                # only the camera (and the headlight, which follows it) changes between views
+                mujoco.mjv_updateCamera(self.physics.model.ptr, self.physics.data.ptr, camera.ptr, self._scene.ptr)
+                mujoco.mjv_makeLights(self.physics.model.ptr, self.physics.data.ptr, self._scene.ptr)
+            mujoco.mjr_render(self._rect, self._scene.ptr, context)
+            mujoco.mjr_readPixels(self._rgb_buffer, None, self._rect, context)
+            out[idx] = self._rgb_buffer[::-1]  # OpenGL rows start at the bottom
+
+def render_views(physics, camera_ids, height=360, width=480, sizes=None):
+    ''' Render all `camera_ids` for the current physics state in one pass: (V, H, W, 3) uint8,
+        or {(height, width): (V, h, w, 3)} for a list of `sizes` (see `make_renderer`). '''
+    if sizes is not None:
+        return make_renderer(physics, dict(camera_ids=camera_ids, sizes=sizes))()
+    return MultiViewRenderer(physics, camera_ids, height=height, width=width).render()
+
+def pyramid_sizes(sizes):
+    ''' Validate a list of (height, width) sizes; returns them largest first.
+
+        All sizes must have the aspect ratio of the largest one (to within a pixel),
+        as they are area-downsampled from it.
+    '''
+    sizes = sorted({(int(h), int(w)) for h, w in sizes}, key=lambda size: size[0] * size[1], reverse=True)
+    if not sizes:
+        raise ValueError("sizes must list at least one (height, width)")
+    height, width = sizes[0]
+    for h, w in sizes[1:]:
+        if h > height or w > width or abs(w - h * width / height) > 1:
+            raise ValueError(f"size {h}x{w} is not a downscale of {height}x{width} with the same aspect ratio")
+    return sizes
+
+@lru_cache(maxsize=None)
+def area_weights(in_size, out_size):
+    ''' (out_size, in_size) matrix averaging the input pixels each output pixel covers (fractionally at the edges). '''
+    edges = np.arange(out_size + 1) * (in_size / out_size)
+    pixels = np.arange(in_size)
+    overlap = np.minimum(edges[1:, None], pixels + 1) - np.maximum(edges[:-1, None], pixels)
+    return (np.clip(overlap, 0, None) * (out_size / in_size)).astype(np.float32)
+
+def area_downsample(pixels, height, width):
+    ''' Area-downsample uint8 images (..., H, W, C) to (..., height, width, C). '''
+    in_height, in_width = pixels.shape[-3:-1]
+    if (in_height, in_width) == (height, width):
+        return pixels
+    # (..., C, H, W), so both passes are batched matmuls
+    x = np.moveaxis(pixels, -1, -3).astype(np.float32)
+    x = area_weights(in_height, height) @ x @ area_weights(in_width, width).T
+    return np.rint(np.moveaxis(x, -3, -1)).astype(np.uint8)
+
+def render_pyramid(pixels, sizes):
+    ''' {(height, width): images} for every size in `sizes`, downsampled from `pixels` (..., H, W, 3). '''
+    return {(h, w): area_downsample(pixels, h, w) for h, w in sizes}
+
+def make_renderer(physics, render_opts=default_render_opts):
+    ''' A function that renders the current state of `physics` with `render_opts`.
+
+        With a `camera_ids` list in render_opts (instead of `camera_id`), every call renders
+        all views in one pass and returns (V, H, W, 3); otherwise this is `physics.render`.
+
+        With a `sizes` list of (height, width) in render_opts (instead of height/width), every
+        call renders once at the largest size and returns {(height, width): pixels} with the
+        smaller sizes area-downsampled from it (see `pyramid_sizes`).
+    '''
+    if 'sizes' in render_opts:
+        sizes = pyramid_sizes(render_opts['sizes'])
+        height, width = sizes[0]
+        opts = {k: v for k,v in render_opts.items() if k != 'sizes'}
+        render = make_renderer(physics, {**opts, 'height': height, 'width': width})
+        return lambda: render_pyramid(render(), sizes)
+    if 'camera_ids' in render_opts:
+        opts = {k: v for k,v in render_opts.items() if k != 'camera_ids'}
+        return MultiViewRenderer(physics, render_opts['camera_ids'], **opts).render
+    return lambda: physics.render(**render_opts)
+
 def get_physics_engine(simulation, xml_fun):
     start_positions = simulation['start_positions']
 
@@ -50,13 +174,15 @@ def render_from_simulation(simulation, xml_fun, render_opts=default_render_opts)
     physics.model.opt.timestep = simulation['params']['timestep']
     step = 0
     frames = []
+    render = make_renderer(physics, render_opts)
 
     # render frames
     # resolution of stored frames (framerate) can be coarser than the physics timestep
     # (smaller timesteps = more stable physics; but storing/rendering every tiny step
     #  might not be necessary; e.g., timestep .001 results in good physics, but 
     # videos render only at 30 or 60Hz, i.e., framerate = .033 or .0167)
-    for frame in simulation['trajectory']:
+    trajectory = densify_trajectory(simulation['trajectory'], simulation['params'])
+    for frame in trajectory:
         # iterate the physics engine until we reach the next stored frame
         while step < frame['physics_step']:
             physics.step()
@@ -72,16 +198,19 @@ def render_from_simulation(simulation, xml_fun, render_opts=default_render_opts)
             name = data['name']
             physics.data.geom(name).xpos = np.array(data['xyz'])
             physics.data.geom(name).xmat = np.array(data['xmat'])
-        pixels = physics.render(**render_opts)
+        pixels = render()
         frames.append(pixels)
     
-    assert len(frames) == len(simulation['trajectory'])
+    assert len(frames) == len(trajectory)
 
     return frames  
 
 def show_tower(positions):
     ''' Visualize tower positions using matplotlib.
     '''
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
+
     if not isinstance(positions[0], DotDict): positions = [DotDict(p) for p in positions]
 
     fig1 = plt.figure()
@@ -112,6 +241,8 @@ def show_tower(positions):
         
 def show_tower_grid(list_of_positions, max_cols=4):
     ''' Visualize multiple towers positions using matplotlib in a grid format. '''
+    import matplotlib.pyplot as plt
+    import matplotlib.patches as patches
     
     sideLength = list_of_positions[0][0]['lx']
 
@@ -162,6 +293,11 @@ def show_tower_grid(list_of_positions, max_cols=4):
     plt.show()
 
 def display_video(frames, framerate=30):
+    import matplotlib
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+    from IPython.display import HTML
+
     height, width, _ = frames[0].shape
     dpi = 70
     orig_backend = matplotlib.get_backend()
@@ -3,12 +3,17 @@
     while storing the trajectories / video frames.
 '''
 import os
+import time
+import numpy as np
+from functools import partial
 from dm_control import mujoco
 from joblib import Parallel, delayed
 from fastprogress import progress_bar
 from pdb import set_trace
 
 from .towerstats import compute_will_fall
+from .trajectory import encode_trajectory, pose_change
+from .render import make_renderer
 
 def get_num_boxes(physics):
     box_type_index = mujoco.mjtGeom.mjGEOM_BOX.value
@@ -51,62 +56,394 @@ def get_box_data(physics):
         ))
     return box_data 
 
-def run_simulation(physics, duration, framerate, timestep=.001, render_frames=False, render_opts={}):
+def get_box_ids(physics):
+    return [physics.model.name2id(f'box{box_idx}', 'geom') for box_idx in range(get_num_boxes(physics))]
+
+# --------------------------------------------------------
+#  Outcome summaries, updated at every stored frame so that
+#  analyses don't need to scan the stored trajectory
+# --------------------------------------------------------
+
+def init_outcome_summary(physics, fall_tol=.10):
+    ''' Start tracking outcome summaries for the current physics state.
+
+        A tower "fell" once any block has moved more than `fall_tol` times its
+        smallest side length from its starting position. Boxes without a (free) joint
+        can't move, so a static world model is marked 'static' and never updated.
+    '''
+    box_ids = np.array(get_box_ids(physics), dtype=int)
+    joint_ids = physics.model.body_jntadr[physics.model.geom_bodyid[box_ids]]
+    dynamic = joint_ids >= 0
+    dof_adr = physics.model.jnt_dofadr[joint_ids[dynamic]]
+    geom_xpos = physics.data.geom_xpos  # views into the engine's memory, valid until the next reset
+    start = geom_xpos[box_ids]
+    tol = fall_tol * 2 * physics.model.geom_size[box_ids].min(axis=1)
+    return dict(
+        box_ids=box_ids,
+        geom_xpos=geom_xpos,
+        qvel=physics.data.qvel,
+        static=not dynamic.any(),
+        dynamic=dynamic,
+        vel_idx=dof_adr[:, None] + np.arange(3),  # linear velocity of each free joint
+        fall_tol=fall_tol,
+        tol2=tol**2,
+        start=start,
+        prev=start,
+        fall_time=None,
+        max_speed2=np.zeros(len(box_ids)),
+    )
+
+def update_outcome_summary(state, physics):
+    ''' Record the current state (called at every stored frame). '''
+    # squared distances throughout, to keep the cost low
+    xpos = state['geom_xpos'][state['box_ids']]
+    vel = state['qvel'][state['vel_idx']]
+    speed2 = state['max_speed2'][state['dynamic']]
+    state['max_speed2'][state['dynamic']] = np.maximum(speed2, np.einsum('ij,ij->i', vel, vel))
+    if state['fall_time'] is None:
+        disp = xpos - state['start']
+        if np.any(np.einsum('ij,ij->i', disp, disp) > state['tol2']):
+            state['fall_time'] = physics.data.time
+    state['prev'] = xpos
+
+def finalize_outcome_summary(state):
+    ''' Flat summary of a rollout:
+
+        fell: whether any block moved more than fall_tol side lengths (checked at stored frames)
+        fall_time: simulation time of the first stored frame at which that happened (None if it never did)
+        final_displacement: per block, distance between start and final position
+        max_velocity: per block, max linear speed (of its free joint) over the stored frames
+    '''
+    return dict(
+        fell=state['fall_time'] is not None,
+        fall_time=state['fall_time'],
+        fall_tol=state['fall_tol'],
+        final_displacement=np.linalg.norm(state['prev'] - state['start'], axis=1).tolist(),
+        max_velocity=np.sqrt(state['max_speed2']).tolist(),
+    )
+
+def copy_outcome_summary(state):
+    ''' Detached copy of a summary state (for snapshots); see `resume_outcome_summary`. '''
+    return {k: v.copy() if isinstance(v, np.ndarray) else v for k,v in state.items() if k not in ('geom_xpos', 'qvel')}
+
+def resume_outcome_summary(state, physics):
+    ''' Continue tracking a copied summary state on `physics` (after `set_physics_state`). '''
+    state = copy_outcome_summary(state)
+    state['geom_xpos'] = physics.data.geom_xpos
+    state['qvel'] = physics.data.qvel
+    state['prev'] = state['geom_xpos'][state['box_ids']]
+    return state
+
+# --------------------------------------------------------
+#  Snapshots of the full physics state, so that rollouts
+#  sharing a prefix can branch from it
+# --------------------------------------------------------
+
+state_fields = ('qpos', 'qvel', 'act', 'qacc_warmstart')
+
+def get_physics_state(physics):
+    ''' Copy of the full dynamic state: qpos, qvel, act and time (plus the solver warmstart,
+        so that an unperturbed branch continues exactly like an uninterrupted rollout).
+    '''
+    state = {field: getattr(physics.data, field).copy() for field in state_fields}
+    state['time'] = physics.data.time
+    return state
+
+def set_physics_state(physics, state, perturb=None):
+    ''' Restore a state from `get_physics_state`; `perturb(physics)` may then modify it
+        (e.g. `nudge_block`) before the derived quantities (geom poses etc.) are recomputed.
+    '''
+    with physics.reset_context():
+        for field in state_fields:
+            getattr(physics.data, field)[:] = state[field]
+        physics.data.time = state['time']
+        if perturb is not None:
+            perturb(physics)
+
+def nudge_block(physics, box_idx, velocity=(0, 0, 0), displacement=(0, 0, 0)):
+    ''' Perturbation: add a linear velocity (m/s) and/or displacement (m), in world coordinates,
+        to block `box_idx`. Use with partial, e.g. partial(nudge_block, box_idx=2, velocity=(.2, 0, 0)).
+    '''
+    body_id = physics.model.geom_bodyid[physics.model.name2id(f'box{box_idx}', 'geom')]
+    joint_id = physics.model.body_jntadr[body_id]
+    if joint_id < 0:
+        raise ValueError(f"box{box_idx} has no joint to perturb (static world model?)")
+    qpos_adr, dof_adr = physics.model.jnt_qposadr[joint_id], physics.model.jnt_dofadr[joint_id]
+    physics.data.qpos[qpos_adr:qpos_adr+3] += displacement
+    physics.data.qvel[dof_adr:dof_adr+3] += velocity
+
+def iter_simulation(physics, duration, framerate, timestep=.001, render_frames=False, render_opts={},
+                    summary=None, fall_tol=.10, start_state=None, perturb=None, snapshot=None, keyframe_tol=None):
+    '''
+        Generator version of `run_simulation`: resets and steps the physics engine, yielding
+        (meta, poses, pixels) for each stored frame as soon as it is produced, so consumers
+        (writers, encoders, online training loops) can process a rollout in constant memory.
+
+        meta: dict(physics_step, t, video_frame, video_t)
+        poses: dict(xyz=(N, 3), xmat=(N, 9)) arrays (copies) for the boxes, in box order
+        pixels: the rendered frame (see `make_renderer`), or None without `render_frames`
+
+        If `summary` is a dict, it is filled with the outcome summary (see
+        `finalize_outcome_summary`) once the rollout has finished.
+
+        Branching: if `snapshot` is a dict, it is filled with the final state of the rollout
+        (`get_physics_state`, plus the step/frame counters and the summary state). Passing
+        that as `start_state` resumes from it instead of resetting, so frames, counters and
+        the summary continue where the snapshot left off, and `perturb(physics)` is applied
+        to the resumed (or reset) state before the first step.
+
+        Adaptive recording: with `keyframe_tol` (meters), a frame is only yielded when some block
+        has moved more than keyframe_tol (largest corner displacement, see `pose_change`) since
+        the last yielded frame, along with the frame just before it; the first and last frames
+        are always yielded. Resting towers and at-rest tails then cost two frames, and
+        `densify_trajectory` interpolates back to the full frame rate (see `select_keyframes`).
+
+            for meta, poses, pixels in iter_simulation(physics, 3, 60, render_frames=True):
+                writer.write(pixels)
+    '''
     physics.model.opt.timestep = timestep
-    physics.reset()  # Reset state and time
-    trajectory = []  
-    frames = []
-    step_num = 0
-    frame_num = 0
-    while physics.data.time < duration:  
-        if len(trajectory) <= physics.data.time * framerate:
-            if render_frames:
-                pixels = physics.render(**render_opts)
-                frames.append(pixels)
-            curr_data = get_box_data(physics)
-            trajectory.append(dict(
+    track = summary is not None or snapshot is not None
+    if start_state is None:
+        if perturb is None:
+            physics.reset()  # Reset state and time
+        else:
+            with physics.reset_context():
+                perturb(physics)
+        step_num = 0
+        frame_num = 0
+        state = init_outcome_summary(physics, fall_tol=fall_tol) if track else None
+    else:
+        set_physics_state(physics, start_state, perturb=perturb)
+        step_num = start_state['physics_step']
+        frame_num = start_state['video_frame']
+        state = resume_outcome_summary(start_state['summary'], physics) if track else None
+    box_ids = get_box_ids(physics)
+    geom_xpos, geom_xmat = physics.data.geom_xpos, physics.data.geom_xmat
+    render = make_renderer(physics, render_opts) if render_frames else None
+    if keyframe_tol is not None:
+        if render_frames:
+            raise ValueError("keyframe recording doesn't render; use render_from_simulation on the result")
+        half_sizes = physics.model.geom_size[box_ids]
+        keyframe = pending = None
+    while physics.data.time < duration:
+        if frame_num <= physics.data.time * framerate:
+            meta = dict(
                 physics_step=step_num,
                 t=physics.data.time,
                 video_frame=frame_num,
-                video_t=frame_num*(1/framerate),        
-                data=curr_data,
-            ))
+                video_t=frame_num*(1/framerate),
+            )
+            poses = dict(xyz=geom_xpos[box_ids], xmat=geom_xmat[box_ids])
+            if keyframe_tol is None:
+                yield meta, poses, render() if render_frames else None
+            elif keyframe is None or pose_change(keyframe['xyz'], keyframe['xmat'], poses['xyz'], poses['xmat'],
+                                                 half_sizes).max() > keyframe_tol:
+                if pending is not None:
+                    yield pending  # the last pose before the change
+                yield meta, poses, None
+                keyframe, pending = poses, None
+            else:
+                pending = (meta, poses, None)
             frame_num += 1
-        physics.step() 
-        step_num+=1 
-  
+            if state is not None and not state['static']:
+                update_outcome_summary(state, physics)
+        physics.step()
+        step_num+=1
+
+    if state is not None and not state['static']:
+        state['prev'] = geom_xpos[box_ids]  # final positions
+    if keyframe_tol is not None and pending is not None:
+        yield pending
+    if summary is not None:
+        summary.update(finalize_outcome_summary(state))
+    if snapshot is not None:
+        snapshot.update(get_physics_state(physics), physics_step=step_num, video_frame=frame_num,
+                        summary=copy_outcome_summary(state))
+
+def run_simulation(physics, duration, framerate, timestep=.001, render_frames=False, render_opts={},
+                   return_summary=False, fall_tol=.10, start_state=None, perturb=None, snapshot=None,
+                   keyframe_tol=None):
+    '''
+        Reset and step the physics engine for `duration` seconds, storing the box poses
+        (and optionally rendered pixels) at `framerate`.
+
+        `render_opts` may list several cameras as `camera_ids`, in which case each frame is
+        a (V, H, W, 3) array with all views rendered from one scene update (see `make_renderer`).
+
+        Returns (trajectory, frames), or (trajectory, frames, summary) with `return_summary`,
+        where summary holds the outcome scalars described in `finalize_outcome_summary`.
+        Use `iter_simulation` to consume frames as they are produced instead; `start_state`,
+        `perturb`, `snapshot` and `keyframe_tol` are described there.
+    '''
+    trajectory = []
+    frames = []
+    summary = dict() if return_summary else None
+    frame_iter = iter_simulation(physics, duration, framerate, timestep=timestep, render_frames=render_frames,
+                                 render_opts=render_opts, summary=summary, fall_tol=fall_tol,
+                                 start_state=start_state, perturb=perturb, snapshot=snapshot,
+                                 keyframe_tol=keyframe_tol)
+    box_ids = get_box_ids(physics)
+    box_names = [physics.model.id2name(box_id, 'geom') for box_id in box_ids]
+    for meta, poses, pixels in frame_iter:
+        if render_frames:
+            frames.append(pixels)
+        curr_data = [dict(id=box_id, name=name, xmat=xmat, xyz=xyz) for box_id, name, xmat, xyz
+                     in zip(box_ids, box_names, poses['xmat'].tolist(), poses['xyz'].tolist())]
+        trajectory.append(dict(**meta, data=curr_data))
+
+    if summary is not None:
+        return trajectory, frames, summary
+
     return trajectory, frames
 
+def iter_trajectory(start_positions, xml_fun, duration=3, framerate=60, timestep=.001, scale_factor=1.0,
+                    render_frames=False, render_opts=dict(height=360,width=480,camera_id="closeup"),
+                    summary=None, fall_tol=.10):
+    '''
+        Generator version of `generate_trajectory`: builds the physics engine for a tower and
+        yields (meta, poses, pixels) per frame, as described in `iter_simulation`.
+    '''
+    scaled_positions = [{k:v/scale_factor if isinstance(v,(int,float)) else v for k,v in pos.items()} for pos in start_positions]
+    physics = mujoco.Physics.from_xml_string(xml_fun(scaled_positions))
+    yield from iter_simulation(physics, duration, framerate, timestep=timestep, render_frames=render_frames,
+                               render_opts=render_opts, summary=summary, fall_tol=fall_tol)
+
 def generate_trajectory(start_positions, xml_fun, duration=3, framerate=60, timestep=.001, scale_factor=1.0,
-                        render_frames=False, render_opts=dict(height=360,width=480,camera_id="closeup")):
+                        render_frames=False, render_opts=dict(height=360,width=480,camera_id="closeup"),
+                        compact=False, compact_dtype='float32', fall_tol=.10, keyframe_tol=None, cache=None):
+    '''
+        Simulate a tower from its start positions.
+
+        If `compact` is True the trajectory is stored in the compact array format
+        (see `block_towers.trajectory.encode_trajectory`, with dtype `compact_dtype`)
+        instead of a list of per-frame dicts.
+
+        The returned simulation includes a `summary` of the outcome (fell, fall_time,
+        final_displacement, max_velocity), computed during the rollout.
+
+        With `keyframe_tol`, only keyframes are stored (see `iter_simulation`); read the
+        trajectory back at the full frame rate with `densify_trajectory(trajectory, params)`.
+
+        With a `cache` (a `block_towers.cache.SimulationCache`), a tower simulated before with
+        the same world model and params is loaded instead of simulated (not when rendering frames).
+    '''
     # scale the item locations and sizes by scale_factor
     scaled_positions = [{k:v/scale_factor if isinstance(v,(int,float)) else v for k,v in pos.items()} for pos in start_positions]
 
     # setup the xml world model for the physics engine
     world_model = xml_fun(scaled_positions)
 
+    if cache is not None and not render_frames:
+        key = cache.key(scaled_positions, world_model, dict(duration=duration, framerate=framerate, timestep=timestep,
+                        scale_factor=scale_factor, fall_tol=fall_tol, keyframe_tol=keyframe_tol))
+        simulation = cache.get(key, compact=compact, compact_dtype=compact_dtype)
+        if simulation is not None:
+            return simulation, []
+
     # initialize the physics engine
     physics = mujoco.Physics.from_xml_string(world_model)  
 
     # run the simulation
-    trajectory, frames = run_simulation(physics, duration, framerate, timestep=timestep, 
-                                        render_frames=render_frames, render_opts=render_opts)
+    trajectory, frames, summary = run_simulation(physics, duration, framerate, timestep=timestep,
+                                                 render_frames=render_frames, render_opts=render_opts,
+                                                 return_summary=True, fall_tol=fall_tol, keyframe_tol=keyframe_tol)
     
+    params = dict(duration=duration,framerate=framerate,timestep=timestep,scale_factor=scale_factor)
+    if keyframe_tol is not None:
+        params['keyframe_tol'] = keyframe_tol
+    simulation = make_simulation(scaled_positions, params, trajectory, summary,
+                                 compact=compact, compact_dtype=compact_dtype)
+    if cache is not None and not render_frames:
+        # the full-precision trajectory, which the cache stores compact
+        cache.put(key, dict(simulation, trajectory=trajectory))
+
+    return simulation, frames
+
+def make_simulation(scaled_positions, params, trajectory, summary, compact=False, compact_dtype='float32'):
+    ''' The simulation dict stored for a rollout (see `generate_trajectory`). '''
     # get the final positions
     final_positions = []
-    data = trajectory[-1]['data']
     for box in trajectory[-1]['data']:
         x,y,z = box['xyz']
         final_positions.append(dict(x=x, y=y, z=z))
-    
-    simulation = dict(
-        params=dict(duration=duration,framerate=framerate,timestep=timestep,scale_factor=scale_factor),             
+
+    if compact:
+        trajectory = encode_trajectory(trajectory, dtype=compact_dtype)
+
+    return dict(
+        params=params,
         start_positions=scaled_positions,
         final_positions=final_positions,
-        trajectory=trajectory,      
+        summary=summary,
+        trajectory=trajectory,
     )
 
-    return simulation, frames
+def run_branches(physics, snapshot, perturbations, duration, framerate, timestep=.001, render_frames=False,
+                 render_opts={}, fall_tol=.10):
+    '''
+        Continue the rollout captured in `snapshot` (see `iter_simulation`) until `duration`,
+        once per perturbation (a callable applied to the restored physics, or None for an
+        unperturbed branch), one after the other on the same engine.
+
+        Returns a list of (trajectory, frames, summary), with the frames after the fork only.
+    '''
+    return [run_simulation(physics, duration, framerate, timestep=timestep, render_frames=render_frames,
+                           render_opts=render_opts, return_summary=True, fall_tol=fall_tol,
+                           start_state=snapshot, perturb=perturb)
+            for perturb in perturbations]
+
+def run_branches_from_xml(world_model, snapshot, perturbations, *args, **kwargs):
+    ''' `run_branches` on a fresh engine built from `world_model`, for use in worker processes. '''
+    physics = mujoco.Physics.from_xml_string(world_model)
+    return run_branches(physics, snapshot, perturbations, *args, **kwargs)
+
+def generate_branched_trajectories(start_positions, xml_fun, fork_time, perturbations, duration=3, framerate=60,
+                                   timestep=.001, scale_factor=1.0, render_frames=False,
+                                   render_opts=dict(height=360,width=480,camera_id="closeup"),
+                                   compact=False, compact_dtype='float32', fall_tol=.10, num_workers=1):
+    '''
+        Counterfactual rollouts of one tower: simulate until `fork_time` once, snapshot the
+        physics state, then run one branch per entry of `perturbations` from that snapshot
+        (callables applied at the fork, e.g. partial(nudge_block, box_idx=2, velocity=(.2,0,0)),
+        or None for the unperturbed continuation).
+
+        With num_workers > 1 the branches are split across a joblib pool; each worker builds its
+        own engine from the world model (perturbations must then be picklable, so use partial
+        rather than lambdas).
+
+        Returns (simulations, frames): one simulation dict (as from `generate_trajectory`, with
+        the shared prefix included in every trajectory) and list of frames per branch.
+    '''
+    scaled_positions = [{k:v/scale_factor if isinstance(v,(int,float)) else v for k,v in pos.items()} for pos in start_positions]
+    world_model = xml_fun(scaled_positions)
+    physics = mujoco.Physics.from_xml_string(world_model)
+
+    # the shared prefix, simulated once
+    snapshot = dict()
+    prefix_trajectory, prefix_frames = run_simulation(physics, fork_time, framerate, timestep=timestep,
+                                                      render_frames=render_frames, render_opts=render_opts,
+                                                      fall_tol=fall_tol, snapshot=snapshot)
+
+    branch_args = (duration, framerate, timestep, render_frames, render_opts, fall_tol)
+    if num_workers == 1:
+        branches = run_branches(physics, snapshot, perturbations, *branch_args)
+    else:
+        chunks = [perturbations[i::num_workers] for i in range(num_workers)]
+        results = Parallel(n_jobs=num_workers)(delayed(run_branches_from_xml)(world_model, snapshot, chunk, *branch_args)
+                                               for chunk in chunks if chunk)
+        # undo the round-robin split
+        branches = [None] * len(perturbations)
+        for i, result in enumerate(results):
+            branches[i::num_workers] = result
+
+    params = dict(duration=duration,framerate=framerate,timestep=timestep,scale_factor=scale_factor,fork_time=fork_time)
+    simulations, frames = [], []
+    for trajectory, branch_frames, summary in branches:
+        simulations.append(make_simulation(scaled_positions, params, prefix_trajectory + trajectory, summary,
+                                           compact=compact, compact_dtype=compact_dtype))
+        frames.append(prefix_frames + branch_frames)
+
+    return simulations, frames
 
 def generate_batch_initial_positions(gen_fun, num_blocks=3, side_length=.40, std=.350, truncate=.60, num_samples=1000, pct_fall=.50, mb=None):
     num_unstable = int(num_samples*pct_fall)
@@ -128,7 +465,60 @@ def generate_batch_initial_positions(gen_fun, num_blocks=3, side_length=.40, std
             pbar.update(len(stable)+len(unstable))
     return stable, unstable
 
-def generate_trajectories_parallel(gen_fun, start_positions, num_workers=len(os.sched_getaffinity(0)), mb=None):
+def generate_trajectories_parallel(gen_fun, start_positions, num_workers=len(os.sched_getaffinity(0)), mb=None,
+                                   backend='processes'):
+    ''' Run gen_fun on every tower in a joblib process pool, or, with backend='threads', in
+        one process on a thread pool (see `block_towers.threaded`).
+    '''
+    if backend == 'threads':
+        from .threaded import generate_trajectories_threaded
+        return generate_trajectories_threaded(gen_fun, start_positions, num_workers=num_workers, mb=mb)
+    if backend != 'processes':
+        raise ValueError(f"unknown backend {backend!r}, expected 'processes' or 'threads'")
     results = Parallel(n_jobs=num_workers)(delayed(gen_fun)(start_pos) for start_pos in progress_bar(start_positions, parent=mb))
     simulations, frames = zip(*results)
-    return simulations, frames
\ No newline at end of file
+    return simulations, frames
+
+
+def compare_physics_profiles(start_positions, xml_fun, profile='fast', reference='default', duration=3, framerate=60,
+                             timestep=.001, num_workers=len(os.sched_getaffinity(0)), backend='threads', mb=None):
+    '''
+        Accuracy check for a physics profile: simulate the same towers with xml_fun(..., profile=reference)
+        and xml_fun(..., profile=profile) (see `physics_profiles` in the world models) and compare outcomes.
+
+        Returns a dict with
+            fell_agreement: fraction of towers whose `fell` outcome is the same
+            fall_time_error: mean and max |difference| of fall_time (s), over towers that fell in both
+            final_position_error: mean and max distance between final block positions
+            seconds / towers_per_sec: simulation time of each profile
+    '''
+    results = dict()
+    for name in (reference, profile):
+        gen_fun = partial(generate_trajectory, xml_fun=partial(xml_fun, profile=name), duration=duration,
+                          framerate=framerate, timestep=timestep)
+        start = time.perf_counter()
+        simulations, _ = generate_trajectories_parallel(gen_fun, start_positions, num_workers=num_workers,
+                                                        mb=mb, backend=backend)
+        results[name] = (simulations, time.perf_counter() - start)
+
+    ref_sims, ref_seconds = results[reference]
+    sims, seconds = results[profile]
+    fell = np.array([[a['summary']['fell'], b['summary']['fell']] for a, b in zip(ref_sims, sims)], dtype=bool)
+    fall_time_errors = np.array([abs(a['summary']['fall_time'] - b['summary']['fall_time'])
+                                 for a, b in zip(ref_sims, sims) if a['summary']['fell'] and b['summary']['fell']])
+    position_errors = np.concatenate([
+        np.linalg.norm(np.array([[p['x'], p['y'], p['z']] for p in a['final_positions']]) -
+                       np.array([[p['x'], p['y'], p['z']] for p in b['final_positions']]), axis=1)
+        for a, b in zip(ref_sims, sims)])
+
+    return dict(
+        reference=reference,
+        profile=profile,
+        num_towers=len(start_positions),
+        fell_agreement=float((fell[:, 0] == fell[:, 1]).mean()),
+        fall_time_error=dict(mean=float(fall_time_errors.mean()) if len(fall_time_errors) else 0.0,
+                             max=float(fall_time_errors.max()) if len(fall_time_errors) else 0.0),
+        final_position_error=dict(mean=float(position_errors.mean()), max=float(position_errors.max())),
+        seconds={reference: ref_seconds, profile: seconds},
+        towers_per_sec={reference: len(start_positions) / ref_seconds, profile: len(start_positions) / seconds},
+    )
@@ -0,0 +1,156 @@
+'''
+    Spatial index over generated towers, for near-duplicate detection and
+    similarity queries.
+
+    Each tower is described by its normalized block offsets: for every block
+    above the base, the x/y offset from the block below divided by the side
+    length of the block below. Towers with the same number of blocks live in the
+    same vector space (of size 2*(num_blocks-1)), and a KD-tree per num_blocks
+    answers radius / nearest-neighbor queries in O(log n), instead of comparing
+    every pair of towers in python.
+
+    Distances are euclidean in offset units (fractions of a side length), so
+    radius=0.01 matches towers whose offsets all agree to within ~1% of a block.
+'''
+import numpy as np
+from scipy.spatial import cKDTree
+
+from .cubes import towers_to_array
+
+def tower_offsets(list_of_positions):
+    ''' Normalized block offsets of towers that all have the same number of blocks.
+
+        Returns a (num_towers, 2*(num_blocks-1)) array ordered dx1, dy1, dx2, dy2, ...
+    '''
+    arr = towers_to_array(list_of_positions, keys=('x', 'y', 'lx', 'ly'))
+    if np.isnan(arr).any():
+        raise ValueError("tower_offsets expects towers with the same number of blocks; use group_by_num_blocks")
+    offsets = (arr[:, 1:, :2] - arr[:, :-1, :2]) / arr[:, :-1, 2:]
+    return offsets.reshape(len(arr), -1)
+
+def group_by_num_blocks(list_of_positions):
+    ''' Map num_blocks -> indices (into list_of_positions) of the towers with that many blocks. '''
+    num_blocks = np.array([len(positions) for positions in list_of_positions])
+    return {int(n): np.flatnonzero(num_blocks == n) for n in np.unique(num_blocks)}
+
+class TowerIndex(object):
+    ''' KD-tree index over towers, one tree per num_blocks.
+
+        index = TowerIndex()
+        index.add(dataset['stack5_stable']['train']['data'])
+        ids = index.query_radius(candidates, radius=0.01)
+        dist, ids = index.query_knn(candidates, k=5)
+
+        `add` can be called repeatedly (bulk inserts); trees are rebuilt lazily on
+        the next query. Each tower gets an integer id: its insertion order by default,
+        or the `ids` passed to `add` (e.g. dataset row indices).
+    '''
+    def __init__(self):
+        self._vectors = dict()
+        self._ids = dict()
+        self._trees = dict()
+        self._next_id = 0
+
+    def __len__(self):
+        return sum(len(ids) for chunks in self._ids.values() for ids in chunks)
+
+    def add(self, list_of_positions, ids=None):
+        if ids is None:
+            ids = np.arange(self._next_id, self._next_id + len(list_of_positions))
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids):
+            self._next_id = max(self._next_id, int(ids.max()) + 1)
+
+        for num_blocks, idx in group_by_num_blocks(list_of_positions).items():
+            self._vectors.setdefault(num_blocks, []).append(tower_offsets([list_of_positions[i] for i in idx]))
+            self._ids.setdefault(num_blocks, []).append(ids[idx])
+            self._trees.pop(num_blocks, None)
+
+        return ids
+
+    def tree(self, num_blocks):
+        ''' (cKDTree, ids) for towers with num_blocks blocks, or (None, empty ids) if there are none. '''
+        if num_blocks not in self._vectors:
+            return None, np.empty(0, dtype=np.int64)
+        if num_blocks not in self._trees:
+            vectors = np.concatenate(self._vectors[num_blocks])
+            ids = np.concatenate(self._ids[num_blocks])
+            self._vectors[num_blocks], self._ids[num_blocks] = [vectors], [ids]
+            self._trees[num_blocks] = (cKDTree(vectors), ids)
+        return self._trees[num_blocks]
+
+    def query_radius(self, list_of_positions, radius, workers=-1):
+        ''' For each query tower, the ids of indexed towers within `radius` (sorted). '''
+        results = [None] * len(list_of_positions)
+        for num_blocks, idx in group_by_num_blocks(list_of_positions).items():
+            tree, ids = self.tree(num_blocks)
+            if tree is None:
+                for i in idx: results[i] = np.empty(0, dtype=np.int64)
+                continue
+            neighbors = tree.query_ball_point(tower_offsets([list_of_positions[i] for i in idx]), radius,
+                                              workers=workers)
+            for i, hits in zip(idx, neighbors):
+                results[i] = np.sort(ids[hits])
+        return results
+
+    def query_knn(self, list_of_positions, k=5, workers=-1):
+        ''' Distances and ids (each (num_queries, k)) of the k nearest indexed towers per query.
+
+            Missing neighbors (fewer than k indexed towers with the same num_blocks)
+            have distance inf and id -1.
+        '''
+        distances = np.full((len(list_of_positions), k), np.inf)
+        neighbor_ids = np.full((len(list_of_positions), k), -1, dtype=np.int64)
+        for num_blocks, idx in group_by_num_blocks(list_of_positions).items():
+            tree, ids = self.tree(num_blocks)
+            if tree is None:
+                continue
+            dist, hits = tree.query(tower_offsets([list_of_positions[i] for i in idx]), k=k, workers=workers)
+            dist, hits = dist.reshape(len(idx), k), hits.reshape(len(idx), k)
+            found = hits < len(ids)
+            distances[idx] = np.where(found, dist, np.inf)
+            neighbor_ids[idx] = np.where(found, ids[np.minimum(hits, len(ids) - 1)], -1)
+        return distances, neighbor_ids
+
+    def find_duplicates(self, radius):
+        ''' Ids of indexed towers that are within `radius` of an earlier (lower id) tower.
+
+            Dropping these ids leaves a set in which no two towers are within `radius`.
+        '''
+        duplicates = []
+        for num_blocks in self._vectors:
+            tree, ids = self.tree(num_blocks)
+            order = np.argsort(ids, kind='stable')
+            pairs = tree.query_pairs(radius, output_type='ndarray')
+            if not len(pairs):
+                continue
+            # orient pairs as (earlier, later) by id, then greedily keep the earliest tower of each cluster
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            pairs = np.where((rank[pairs[:, 0]] < rank[pairs[:, 1]])[:, None], pairs, pairs[:, ::-1])
+            pairs = pairs[np.argsort(rank[pairs[:, 0]], kind='stable')]
+            removed = np.zeros(len(ids), dtype=bool)
+            for keep, drop in pairs:
+                if not removed[keep]:
+                    removed[drop] = True
+            duplicates.append(ids[removed])
+        return np.sort(np.concatenate(duplicates)) if duplicates else np.empty(0, dtype=np.int64)
+
+def dedup_towers(list_of_positions, radius=0.01):
+    ''' Indices of towers to keep after dropping near-duplicates (first occurrence wins). '''
+    index = TowerIndex()
+    index.add(list_of_positions)
+    keep = np.ones(len(list_of_positions), dtype=bool)
+    keep[index.find_duplicates(radius)] = False
+    return np.flatnonzero(keep)
+
+def find_leakage(train_positions, test_positions, radius=0.01):
+    ''' (train_idx, test_idx) pairs of towers in two splits that are within `radius` of each other,
+        e.g. to check a test split for near-copies of training towers.
+    '''
+    index = TowerIndex()
+    index.add(train_positions)
+    pairs = [(train_idx, test_idx)
+             for test_idx, hits in enumerate(index.query_radius(test_positions, radius))
+             for train_idx in hits]
+    return np.array(pairs, dtype=np.int64).reshape(-1, 2)
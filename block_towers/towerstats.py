@@ -38,6 +38,31 @@ def compute_will_fall(pos):
 
     return anyFall, willFall
 
+def compute_will_fall_array(arr, keys=('x', 'y', 'z', 'lx', 'ly', 'lz', 'rx', 'ry', 'rz')):
+    ''' Vectorized `compute_will_fall` for a batch of towers.
+
+        arr: (num_towers, max_blocks, len(keys)) array, e.g. from `towers_to_array` (nan padded,
+             bottom block first; keys default to `block_keys`); only x, y, lx, ly are used
+
+        Returns (anyFall (num_towers,), willFall (num_towers, max_blocks)) boolean arrays,
+        with willFall False for padding.
+    '''
+    arr = np.asarray(arr, dtype=float)
+    x, y, lx, ly = (arr[..., keys.index(k)] for k in ('x', 'y', 'lx', 'ly'))
+    valid = ~np.isnan(x)
+
+    # centers of mass of each block + all blocks above it (suffix means over valid blocks)
+    count = np.cumsum(valid[:, ::-1], axis=1)[:, ::-1]
+    center_x = np.cumsum(np.where(valid, x, 0)[:, ::-1], axis=1)[:, ::-1] / np.maximum(count, 1)
+    center_y = np.cumsum(np.where(valid, y, 0)[:, ::-1], axis=1)[:, ::-1] / np.maximum(count, 1)
+
+    willFall = np.zeros(x.shape, dtype=bool)
+    cx, cy = center_x[:, 1:], center_y[:, 1:]
+    bx, by, blx, bly = x[:, :-1], y[:, :-1], lx[:, :-1], ly[:, :-1]
+    willFall[:, 1:] = valid[:, 1:] & ((cx < bx - blx/2) | (cx > bx + blx/2) | (cy < by - bly/2) | (cy > by + bly/2))
+
+    return willFall.any(axis=1), willFall
+
 def compute_ground_truth(pos, sideLength):
     ''''''
 
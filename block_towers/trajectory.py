@@ -0,0 +1,309 @@
+'''
+    Compact storage format for simulated trajectories.
+
+    `run_simulation` stores every frame as a list of per-block dicts holding the
+    full 9-float rotation matrix (`xmat`) and position (`xyz`) as python floats,
+    plus the block `name` and `id`. The compact format stores the same content as
+    flat numeric arrays: positions (xyz) and rotations (as quaternions, w x y z),
+    optionally quantized and delta-encoded over time, with the per-frame metadata
+    stored once per trajectory.
+
+    Encoded trajectories are plain dicts of flat arrays, so they can be stored in
+    a HF dataset column like the original format.
+'''
+import numpy as np
+
+compact_format = 'compact-v1'
+compact_dtypes = ('float32', 'float16', 'int16')
+
+# --------------------------------------------------------
+#  Rotation helpers
+# --------------------------------------------------------
+
+def xmat_to_quat(xmat):
+    ''' Convert row-major rotation matrices (..., 9) to unit quaternions (..., 4) ordered w,x,y,z.
+
+        Uses the largest diagonal pivot for numerical robustness; returned quaternions have w >= 0.
+    '''
+    m = np.asarray(xmat, dtype=np.float64)
+    m00, m01, m02, m10, m11, m12, m20, m21, m22 = np.moveaxis(m, -1, 0)
+
+    # each candidate is 4*q_k*q for the pivot component k
+    candidates = np.stack([
+        np.stack([1 + m00 + m11 + m22, m21 - m12, m02 - m20, m10 - m01], axis=-1),
+        np.stack([m21 - m12, 1 + m00 - m11 - m22, m01 + m10, m02 + m20], axis=-1),
+        np.stack([m02 - m20, m01 + m10, 1 - m00 + m11 - m22, m12 + m21], axis=-1),
+        np.stack([m10 - m01, m02 + m20, m12 + m21, 1 - m00 - m11 + m22], axis=-1),
+    ], axis=-2)
+    pivots = np.stack([1 + m00 + m11 + m22, 1 + m00 - m11 - m22,
+                       1 - m00 + m11 - m22, 1 - m00 - m11 + m22], axis=-1)
+    best = np.argmax(pivots, axis=-1)[..., None, None]
+    quat = np.take_along_axis(candidates, best, axis=-2)[..., 0, :]
+    quat /= np.linalg.norm(quat, axis=-1, keepdims=True)
+    quat *= np.where(quat[..., :1] < 0, -1.0, 1.0)
+
+    return quat
+
+def quat_to_xmat(quat):
+    ''' Convert quaternions (..., 4) ordered w,x,y,z to row-major rotation matrices (..., 9). '''
+    q = np.asarray(quat, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    w, x, y, z = np.moveaxis(q, -1, 0)
+
+    return np.stack([
+        1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y),
+        2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x),
+        2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y),
+    ], axis=-1)
+
+def make_quats_continuous(quat):
+    ''' Flip quaternion signs (q and -q are the same rotation) so consecutive
+        frames (axis 0) stay in the same hemisphere, keeping deltas small.
+    '''
+    dots = np.sum(quat[1:] * quat[:-1], axis=-1)
+    flips = np.where(dots < 0, -1.0, 1.0)
+    signs = np.concatenate([np.ones_like(flips[:1]), np.cumprod(flips, axis=0)])
+    return quat * signs[..., None]
+
+# --------------------------------------------------------
+#  Converting between frame dicts and arrays
+# --------------------------------------------------------
+
+def is_compact_trajectory(trajectory):
+    return isinstance(trajectory, dict) and trajectory.get('format') == compact_format
+
+def trajectory_to_arrays(trajectory):
+    ''' Collect a trajectory (either format) into arrays.
+
+        Returns a dict with per-frame metadata (physics_step, t, video_frame, video_t),
+        per-block metadata (names, ids), xyz (T,N,3) and quat (T,N,4) in float64.
+    '''
+    if is_compact_trajectory(trajectory):
+        return decode_trajectory_arrays(trajectory)
+
+    first = trajectory[0]['data']
+    xyz = np.array([[box['xyz'] for box in frame['data']] for frame in trajectory], dtype=np.float64)
+    xmat = np.array([[box['xmat'] for box in frame['data']] for frame in trajectory], dtype=np.float64)
+
+    return dict(
+        physics_step=np.array([frame['physics_step'] for frame in trajectory], dtype=np.int64),
+        t=np.array([frame['t'] for frame in trajectory], dtype=np.float64),
+        video_frame=np.array([frame['video_frame'] for frame in trajectory], dtype=np.int64),
+        video_t=np.array([frame['video_t'] for frame in trajectory], dtype=np.float64),
+        names=[box['name'] for box in first],
+        ids=[box['id'] for box in first],
+        xyz=xyz.reshape(len(trajectory), len(first), 3),
+        quat=make_quats_continuous(xmat_to_quat(xmat)).reshape(len(trajectory), len(first), 4),
+    )
+
+def arrays_to_trajectory(arrays):
+    ''' Inverse of `trajectory_to_arrays`: rebuild the list-of-frame-dicts format. '''
+    xyz = arrays['xyz'].tolist()
+    xmat = quat_to_xmat(arrays['quat']).tolist()
+    trajectory = []
+    for i in range(len(arrays['t'])):
+        trajectory.append(dict(
+            physics_step=int(arrays['physics_step'][i]),
+            t=float(arrays['t'][i]),
+            video_frame=int(arrays['video_frame'][i]),
+            video_t=float(arrays['video_t'][i]),
+            data=[dict(id=box_id, name=name, xmat=xmat[i][j], xyz=xyz[i][j])
+                  for j,(box_id,name) in enumerate(zip(arrays['ids'], arrays['names']))],
+        ))
+    return trajectory
+
+# --------------------------------------------------------
+#  Encoding / decoding
+# --------------------------------------------------------
+
+def encode_values(values, dtype, delta, scale):
+    ''' Encode float64 `values` (T, ...) as `dtype`, optionally delta-encoded along axis 0.
+
+        int16 values are quantized with step `scale`, so they must lie within
+        +/- 32767*scale (ValueError otherwise); their deltas wrap around
+        (modulo 2**16) and are recovered exactly by a wrapping cumsum.
+        Float deltas are taken against the reconstructed previous frame, so
+        rounding errors do not accumulate over time.
+    '''
+    if dtype == 'int16':
+        quantized = np.round(values / scale)
+        if quantized.size and np.abs(quantized).max() > 32767:
+            raise ValueError(f"values up to {np.abs(values).max():.4g} exceed the int16 range +/- {32767 * scale:.4g} "
+                             f"of scale {scale:g}; use a larger scale or a float dtype")
+        quantized = quantized.astype(np.int16)
+        if delta:
+            quantized = np.diff(quantized, axis=0, prepend=np.zeros_like(quantized[:1]))
+        return quantized
+
+    if not delta:
+        return values.astype(dtype)
+
+    encoded = np.empty(values.shape, dtype=dtype)
+    recon = np.zeros(values.shape[1:], dtype=np.float64)
+    for i in range(len(values)):
+        encoded[i] = values[i] - recon
+        recon = recon + encoded[i]
+    return encoded
+
+def decode_values(encoded, dtype, delta, scale):
+    if dtype == 'int16':
+        if delta:
+            encoded = np.cumsum(encoded, axis=0, dtype=np.int16)
+        return encoded.astype(np.float64) * scale
+
+    encoded = encoded.astype(np.float64)
+    return np.cumsum(encoded, axis=0) if delta else encoded
+
+def encode_trajectory(trajectory, dtype='float32', delta=True, position_scale=1e-4):
+    ''' Encode a trajectory (list of frame dicts from `run_simulation`) in the compact format.
+
+        dtype: 'float32', 'float16' or 'int16' (quantized)
+        delta: store frame-to-frame differences instead of absolute values
+        position_scale: quantization step for positions with dtype='int16' (meters / unit);
+                        the default 1e-4 covers +/- 3.2767 units, and positions outside
+                        +/- 32767*position_scale raise a ValueError. Quaternions use 1/32767.
+    '''
+    if dtype not in compact_dtypes:
+        raise ValueError(f"dtype must be one of {compact_dtypes}, got {dtype!r}")
+
+    arrays = trajectory_to_arrays(trajectory)
+    num_frames, num_blocks, _ = arrays['xyz'].shape
+    quat_scale = 1/32767
+
+    return dict(
+        format=compact_format,
+        dtype=dtype,
+        delta=delta,
+        position_scale=position_scale,
+        quat_scale=quat_scale,
+        num_frames=num_frames,
+        num_blocks=num_blocks,
+        names=arrays['names'],
+        ids=arrays['ids'],
+        physics_step=arrays['physics_step'].astype(np.int32),
+        t=arrays['t'],
+        video_frame=arrays['video_frame'].astype(np.int32),
+        video_t=arrays['video_t'],
+        xyz=encode_values(arrays['xyz'], dtype, delta, position_scale).reshape(-1),
+        quat=encode_values(arrays['quat'], dtype, delta, quat_scale).reshape(-1),
+    )
+
+def decode_trajectory_arrays(encoded):
+    ''' Decode a compact trajectory into float64 arrays (see `trajectory_to_arrays`). '''
+    num_frames, num_blocks = encoded['num_frames'], encoded['num_blocks']
+    dtype, delta = encoded['dtype'], encoded['delta']
+    xyz = np.asarray(encoded['xyz'], dtype=dtype).reshape(num_frames, num_blocks, 3)
+    quat = np.asarray(encoded['quat'], dtype=dtype).reshape(num_frames, num_blocks, 4)
+
+    return dict(
+        physics_step=np.asarray(encoded['physics_step'], dtype=np.int64),
+        t=np.asarray(encoded['t'], dtype=np.float64),
+        video_frame=np.asarray(encoded['video_frame'], dtype=np.int64),
+        video_t=np.asarray(encoded['video_t'], dtype=np.float64),
+        names=list(encoded['names']),
+        ids=list(encoded['ids']),
+        xyz=decode_values(xyz, dtype, delta, encoded['position_scale']),
+        quat=decode_values(quat, dtype, delta, encoded['quat_scale']),
+    )
+
+def decode_trajectory(encoded):
+    ''' Decode a compact trajectory back to the list-of-frame-dicts format of `run_simulation`. '''
+    return arrays_to_trajectory(decode_trajectory_arrays(encoded))
+
+def expand_trajectory(trajectory):
+    ''' Return `trajectory` in the list-of-frame-dicts format, decoding it if it is compact. '''
+    if is_compact_trajectory(trajectory):
+        return decode_trajectory(trajectory)
+    return trajectory
+
+# --------------------------------------------------------
+#  Keyframes: adaptive recording stores a frame only when
+#  some block has moved, densify_* interpolates the rest
+# --------------------------------------------------------
+
+box_corners = np.array([[sx, sy, sz] for sx in (-1, 1) for sy in (-1, 1) for sz in (-1, 1)], dtype=np.float64)
+
+def frame_schedule(duration, framerate, timestep):
+    ''' Replays the time loop of `iter_simulation`: (times, frame_steps), with times[s] the
+        simulation time after s steps (len num_steps+1) and frame_steps the steps at which frames are stored.
+    '''
+    times = [0.0]
+    frame_steps = []
+    while times[-1] < duration:
+        if len(frame_steps) <= times[-1] * framerate:
+            frame_steps.append(len(times) - 1)
+        times.append(times[-1] + timestep)  # accumulated like mjData.time
+    return np.array(times), frame_steps
+
+def pose_change(xyz0, xmat0, xyz1, xmat1, half_sizes):
+    ''' Per block, the largest displacement of any of its corners between two poses
+        (xyz (..., N, 3), xmat (..., N, 9)), so rotations and translations are measured alike.
+    '''
+    corners = box_corners * np.asarray(half_sizes)[..., None, :]  # (N, 8, 3)
+    dmat = (np.asarray(xmat1) - np.asarray(xmat0)).reshape(np.shape(xmat0)[:-1] + (3, 3))
+    disp = (np.asarray(xyz1) - np.asarray(xyz0))[..., None, :] + np.einsum('...nij,...nkj->...nki', dmat, corners)
+    return np.sqrt(np.einsum('...ki,...ki->...k', disp, disp)).max(axis=-1)
+
+def select_keyframes(xyz, xmat, half_sizes, tol):
+    ''' Indices of the frames (of T) that adaptive recording keeps for a keyframe tolerance `tol`
+        (the same rule as `iter_simulation` with keyframe_tol, applied after the fact):
+
+        a frame is kept when some block has moved more than `tol` (see `pose_change`) since the
+        last kept frame, together with the frame just before it (the last pose before the change),
+        and the first and last frames are always kept. Interpolating between the kept frames
+        is then within about 2*tol of every dropped frame.
+    '''
+    keep = [0]
+    for i in range(1, len(xyz)):
+        if pose_change(xyz[keep[-1]], xmat[keep[-1]], xyz[i], xmat[i], half_sizes).max() > tol:
+            if keep[-1] != i - 1:
+                keep.append(i - 1)
+            keep.append(i)
+    if keep[-1] != len(xyz) - 1:
+        keep.append(len(xyz) - 1)
+    return np.array(keep)
+
+def densify_arrays(arrays, params):
+    ''' Fill in the frames dropped by adaptive recording: arrays (from `trajectory_to_arrays`)
+        at every video frame, with poses interpolated between keyframes (linearly for positions,
+        normalized-linearly for quaternions) and the exact physics_step / t of each frame.
+
+        `params` are the simulation params (duration, framerate, timestep). Dense arrays are
+        returned unchanged.
+    '''
+    video_frame = arrays['video_frame']
+    num_frames = int(video_frame[-1]) + 1
+    if len(video_frame) == num_frames:
+        return arrays
+
+    framerate = params['framerate']
+    times, frame_steps = frame_schedule(params['duration'], framerate, params['timestep'])
+    frames = np.arange(num_frames)
+    right = np.clip(np.searchsorted(video_frame, frames), 1, len(video_frame) - 1)
+    left = right - 1
+    alpha = ((frames - video_frame[left]) / (video_frame[right] - video_frame[left]))[:, None, None]
+
+    xyz = (1 - alpha) * arrays['xyz'][left] + alpha * arrays['xyz'][right]
+    quat = (1 - alpha) * arrays['quat'][left] + alpha * arrays['quat'][right]
+    quat /= np.linalg.norm(quat, axis=-1, keepdims=True)
+
+    physics_step = np.asarray(frame_steps[:num_frames], dtype=np.int64)
+    return dict(
+        arrays,
+        physics_step=physics_step,
+        t=times[physics_step],
+        video_frame=frames,
+        video_t=frames * (1/framerate),
+        xyz=xyz,
+        quat=quat,
+    )
+
+def densify_trajectory(trajectory, params):
+    ''' A trajectory (either format, possibly recorded with keyframes) as a list of frame
+        dicts at the full frame rate; see `densify_arrays`.
+    '''
+    trajectory = expand_trajectory(trajectory)
+    num_frames = trajectory[-1]['video_frame'] + 1
+    if len(trajectory) == num_frames:
+        return trajectory
+    return arrays_to_trajectory(densify_arrays(trajectory_to_arrays(trajectory), params))
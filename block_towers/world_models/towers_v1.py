@@ -1,6 +1,8 @@
 '''
   Helper functions for Generating Mujoco XML "World Models"
 '''
+import math
+
 default_colors = [
     [1, 0, 0, 1],
     [1, 1, 0, 1],
@@ -28,7 +30,85 @@ def add_dynamic_cube(idx, x, y, z, lx, ly, lz, r, g, b, a):
     </body>
   '''
 
-def generate_xml_model_from_start_positions(positions, cam_pos=None, colors=default_colors):
+# --------------------------------------------------------
+#  Physics profiles: solver options, selected with `profile`
+#  in the world models
+# --------------------------------------------------------
+
+# MuJoCo's defaults are iterations=100, ls_iterations=50, tolerance=1e-8, integrator=Euler.
+# "fast" only lowers the solver iterations, line-search iterations and tolerance (for towers the
+# Newton solver usually converges in a few iterations); it keeps every contact and the integrator.
+# Euler is already MuJoCo's default, so it is not a speed setting (implicitfast/RK4 were slower
+# than Euler at timestep=.001).
+physics_profiles = dict(
+    default=dict(),
+    fast=dict(iterations=20, ls_iterations=10, tolerance=1e-6),
+)
+
+def get_physics_profile(profile):
+  ''' A profile by name (see `physics_profiles`), or a dict of <option> attributes. '''
+  if isinstance(profile, str):
+    if profile not in physics_profiles:
+      raise ValueError(f"unknown physics profile {profile!r}, expected one of {sorted(physics_profiles)}")
+    return physics_profiles[profile]
+  return dict(profile or {})
+
+def add_options(profile):
+  ''' <option> element for a profile's solver / integrator settings ('' for the defaults). '''
+  options = get_physics_profile(profile)
+  if not options:
+    return ''
+  attrs = ' '.join(f'{k}="{v}"' for k,v in options.items())
+  return f'''  <option {attrs}/>
+'''
+
+def add_camera(name, x, y, z, fovy=45):
+  return f'''
+    <camera name="{name}" fovy="{fovy}" mode="targetbody" target="lookhere"
+      pos="{x} {y} {z}" xyaxes="1 0 0 0 1 2"/>
+  '''
+
+def make_camera_rig(positions, azimuths=(0, 90, 180, 270), distance=None, height=None, fovy=45, prefix='view'):
+  '''
+    A ring of cameras around the tower, all aimed at the "lookhere" target.
+
+    Cameras are named f"{prefix}{i}" and placed at `distance` from the tower axis
+    (default 10x the largest side of the bottom block), at `height` (default that side),
+    and at each azimuth in degrees; azimuth 0 is the default "closeup" viewpoint (-y).
+
+    Pass the result as `cameras` to the world model functions, and render all views
+    at once with `block_towers.render.render_views`.
+  '''
+  pos = positions[0]
+  max_side = max([pos['lx'], pos['ly'], pos['lz']])
+  distance = max_side*10 if distance is None else distance
+  height = max_side if height is None else height
+
+  cameras = []
+  for idx, azimuth in enumerate(azimuths):
+    theta = math.radians(azimuth)
+    cameras.append(dict(name=f'{prefix}{idx}', pos=(distance*math.sin(theta), -distance*math.cos(theta), height), fovy=fovy))
+  return cameras
+
+def add_cameras(positions, cam_pos=None, cameras=None):
+  '''
+    xml for the scene cameras: by default a single "closeup" camera at `cam_pos`,
+    otherwise one camera per dict in `cameras` (name, pos, optional fovy), e.g. from `make_camera_rig`.
+  '''
+  if cameras is None:
+    if cam_pos is None:
+      pos = positions[0]
+      max_side = max([pos['lx'], pos['ly'], pos['lz']])
+      cam_pos = (0, -max_side*10, max_side)
+    cameras = [dict(name='closeup', pos=cam_pos)]
+
+  xml = ''
+  for camera in cameras:
+    x, y, z = camera['pos']
+    xml += add_camera(camera['name'], x, y, z, fovy=camera.get('fovy', 45))
+  return xml
+
+def generate_xml_model_from_start_positions(positions, cam_pos=None, colors=default_colors, cameras=None, profile='default'):
     '''
         This function checks whether the tower is stable or unstable, then
         returns an xml Mujoco world model. For unstable towers we use
@@ -39,13 +119,13 @@ def generate_xml_model_from_start_positions(positions, cam_pos=None, colors=defa
     '''
     anyFall = any([p['unstable'] for p in positions])
     if anyFall:
-        xml = generate_dynamic_world_model(positions, cam_pos=cam_pos, colors=colors)
+        xml = generate_dynamic_world_model(positions, cam_pos=cam_pos, colors=colors, cameras=cameras, profile=profile)
     else:
-        xml = generate_static_world_model(positions, cam_pos=cam_pos, colors=colors)
+        xml = generate_static_world_model(positions, cam_pos=cam_pos, colors=colors, cameras=cameras, profile=profile)
 
     return xml
 
-def generate_dynamic_world_model(positions, cam_pos=None, colors=default_colors):
+def generate_dynamic_world_model(positions, cam_pos=None, colors=default_colors, cameras=None, profile='default'):
   '''
 
     Inputs:
@@ -61,16 +141,12 @@ def generate_dynamic_world_model(positions, cam_pos=None, colors=default_colors)
     The boxes are added as a geom type="box" (see Mujoco docs)
 
   '''
-  if cam_pos is None:
-    pos = positions[0]
-    max_side = max([pos['lx'], pos['ly'], pos['lz']])
-    cam_pos = (0, -max_side*10, max_side)
-
-  cam_x, cam_y, cam_z = cam_pos
+  pos = positions[0]
+  max_side = max([pos['lx'], pos['ly'], pos['lz']])
 
   world_model = f"""
   <mujoco model="tippe top">
-
+{add_options(profile)}
   <asset>
     <texture name="grid" type="2d" builtin="checker" rgb1=".1 .2 .3"
      rgb2=".2 .3 .4" width="600" height="600"/>
@@ -80,10 +156,10 @@ def generate_dynamic_world_model(positions, cam_pos=None, colors=default_colors)
   <worldbody>
     <geom name="floor" size="1 1 .01" type="plane" material="grid"/>
     <light pos="0 0 1" castshadow="false" diffuse="1 1 1"/>
-    <camera name="closeup" fovy="45" mode="targetbody" target="lookhere"
-      pos="{cam_x} {cam_y} {cam_z}" xyaxes="1 0 0 0 1 2"/>
   """
 
+  world_model += add_cameras(positions, cam_pos=cam_pos, cameras=cameras)
+
   for idx,p in enumerate(positions):
     r, g, b, a = colors[idx]
     xml = add_dynamic_cube(idx, p['x'], p['y'], p['z'], 
@@ -102,7 +178,7 @@ def generate_dynamic_world_model(positions, cam_pos=None, colors=default_colors)
 
   return world_model
 
-def generate_static_world_model(positions, cam_pos=None, colors=default_colors):
+def generate_static_world_model(positions, cam_pos=None, colors=default_colors, cameras=None, profile='default'):
   '''
 
     Inputs:
@@ -112,8 +188,14 @@ def generate_static_world_model(positions, cam_pos=None, colors=default_colors):
 
     `cam_pos` (optional) can be the x,y,z position of the camera.
 
+    `cameras` (optional): list of camera dicts (name, pos, fovy) replacing
+    the default "closeup" camera, e.g. from `make_camera_rig`.
+
     `colors` (optional): list of rgba tuples (length must be >= #blocks).
 
+    `profile` (optional): physics profile name or dict (see `physics_profiles`),
+    e.g. 'fast' for fewer solver iterations and a looser tolerance.
+
     Outputs:
     The function outputs a `world_model` in xml format, to be 
     consumed by mujoco physics simulator.
@@ -121,16 +203,12 @@ def generate_static_world_model(positions, cam_pos=None, colors=default_colors):
     The boxes are added as a geom type="box" (see Mujoco docs)
 
   '''
-  if cam_pos is None:
-    pos = positions[0]
-    max_side = max([pos['lx'], pos['ly'], pos['lz']])
-    cam_pos = (0, -max_side*10, max_side)
-
-  cam_x, cam_y, cam_z = cam_pos
+  pos = positions[0]
+  max_side = max([pos['lx'], pos['ly'], pos['lz']])
 
   world_model = f"""
   <mujoco model="tippe top">
-
+{add_options(profile)}
   <asset>
     <texture name="grid" type="2d" builtin="checker" rgb1=".1 .2 .3"
      rgb2=".2 .3 .4" width="600" height="600"/>
@@ -140,10 +218,10 @@ def generate_static_world_model(positions, cam_pos=None, colors=default_colors):
   <worldbody>
     <geom name="floor" size="1 1 .01" type="plane" material="grid"/>
     <light pos="0 0 1" castshadow="false" diffuse="1 1 1"/>
-    <camera name="closeup" fovy="45" mode="targetbody" target="lookhere"
-      pos="{cam_x} {cam_y} {cam_z}" xyaxes="1 0 0 0 1 2"/>        
   """
 
+  world_model += add_cameras(positions, cam_pos=cam_pos, cameras=cameras)
+
   # add each cube
   world_model += '''  
     <body name="tower">
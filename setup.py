@@ -3,4 +3,7 @@ from setuptools import setup, find_packages
 setup(
     name = 'block_towers',
     packages = find_packages(),
-)
\ No newline at end of file
+    entry_points = {
+        'console_scripts': ['block-towers=block_towers.cli:main'],
+    },
+)